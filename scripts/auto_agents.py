@@ -486,6 +486,23 @@ def commit_and_push_changes(agents: List[str], context: Dict[str, List[str]]) ->
         # Stage all changes
         subprocess.run(['git', 'add', '.'], check=True)
         print("   ✅ Staged all changes", file=sys.stderr)
+
+        # Scan only the added lines for secrets before committing
+        sys.path.insert(0, str(Path(__file__).resolve().parent / 'security'))
+        from security_utils import scan_staged
+
+        try:
+            secrets = list(scan_staged())
+        except RuntimeError as e:
+            print(f"   ❌ Secret scan failed: {e}", file=sys.stderr)
+            return False
+
+        if secrets:
+            subprocess.run(['git', 'reset', '-q'], check=True)
+            for secret in secrets[:5]:
+                print(f"   🚨 Potential {secret['type']} in {secret['path']}:{secret['line']}", file=sys.stderr)
+            print("   ❌ Commit blocked: staged changes contain potential secrets", file=sys.stderr)
+            return False
         
         # Create descriptive commit message
         agent_list = ', '.join(agents[:3])
@@ -23,5 +23,22 @@ REL_PATH="${FILE_PATH#$GIT_ROOT/}"
 # Stage and commit
 git add "$FILE_PATH" 2>/dev/null || exit 0
 git diff --cached --quiet && exit 0
+
+# Refuse to commit staged lines that add secrets. scan-staged exits 0 when
+# clean and 1 with JSONL findings on stdout; anything else (2 for a git
+# error, 1 from a Python traceback with no findings) is a scanner failure
+SECURITY_UTILS="${HOME}/.claude/security_utils.py"
+if [[ -f "$SECURITY_UTILS" ]] && command -v python3 &>/dev/null; then
+    FINDINGS=$(python3 "$SECURITY_UTILS" scan-staged 2>/dev/null)
+    SCAN_STATUS=$?
+    if [[ $SCAN_STATUS -eq 1 && "$FINDINGS" == "{"* ]]; then
+        git reset -q -- "$FILE_PATH" 2>/dev/null
+        printf '%s\n' "[SECURITY BLOCK] Potential secret in staged changes, auto-commit skipped: $REL_PATH" >&2
+        exit 0
+    elif [[ $SCAN_STATUS -ne 0 ]]; then
+        printf '%s\n' "[SECURITY] Secret scan failed (exit $SCAN_STATUS), auto-commit skipped: $REL_PATH" >&2
+        exit 0
+    fi
+fi
 git commit --no-verify -m "auto: Update $REL_PATH [$(date '+%H:%M:%S')]" &>/dev/null || true
 exit 0
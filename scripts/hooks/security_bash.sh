@@ -10,6 +10,14 @@
 
 set -uo pipefail
 
+# Fast path: the Python client asks the security daemon, or runs the same
+# checks in-process when the daemon is down. The rules below are the fallback
+# for machines without python3 and are mirrored in security_utils.py.
+CLIENT="${HOME}/.claude/security_client.py"
+if command -v python3 &>/dev/null && [[ -f "$CLIENT" ]]; then
+    exec python3 -I -S "$CLIENT" bash
+fi
+
 # Check jq dependency
 if ! command -v jq &>/dev/null; then
     echo '{"error": "jq required but not installed"}' >&2
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Minimal client for the security check daemon (security_utils.py serve)
+Used by the security hooks in place of per-pattern grep processes
+
+Usage: security_client.py bash|file [--socket PATH] < hook_event.json
+
+Falls back to checking in-process when the daemon is not running. Either
+way the check is recorded in the security audit log.
+
+Exit codes:
+  0 = Allow
+  2 = Block
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.claude', 'security.sock')
+LOG_DIR = os.path.join(os.path.expanduser('~'), '.claude', 'logs')
+DAEMON_TIMEOUT = 0.5  # Seconds before giving up on the daemon
+
+# Tool input field checked by each hook
+FIELDS = {'bash': 'command', 'file': 'file_path'}
+
+# (stderr line, JSON error) per check and block reason, as the shell hooks print them
+MESSAGES = {
+    ('bash', 'dangerous_pattern'): ('[SECURITY BLOCK] Dangerous command pattern detected',
+                                    'Blocked dangerous command pattern'),
+    ('bash', 'system_path'): ('[SECURITY BLOCK] System path access blocked', 'Blocked system path access'),
+    ('file', 'sensitive_file'): ('[SECURITY BLOCK] Sensitive file access blocked: {value}',
+                                 'Blocked access to sensitive file'),
+    ('file', 'system_path'): ('[SECURITY BLOCK] System path access blocked: {value}', 'Blocked system path access'),
+}
+
+
+def ask_daemon(socket_path, check, value, tool_name=None):
+    """Send one request to the daemon; None if it is unavailable or misbehaves"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(DAEMON_TIMEOUT)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps({'check': check, 'value': value, 'tool': tool_name}).encode() + b'\n')
+        response = b''
+        while not response.endswith(b'\n'):
+            chunk = client.recv(4096)
+            if not chunk:
+                return None
+            response += chunk
+        result = json.loads(response)
+        return None if 'error' in result else result
+    except (OSError, ValueError):
+        return None
+    finally:
+        client.close()
+
+
+def check_locally(check, value, tool_name=None):
+    """Run the check in this process, importing security_utils next to this file; audited with one plain append"""
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    from security_utils import HOOK_CHECKS, audit_security_check
+
+    result = HOOK_CHECKS[check](value)
+    audit_security_check(check, value, result, tool_name)
+    return result
+
+
+def log(filename, line):
+    try:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        with open(os.path.join(LOG_DIR, filename), 'a') as f:
+            f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {line}\n")
+    except OSError:
+        pass
+
+
+def main(argv):
+    if not argv or argv[0] not in FIELDS:
+        print('usage: security_client.py bash|file [--socket PATH] < hook_event.json', file=sys.stderr)
+        return 2
+
+    check = argv[0]
+    socket_path = argv[argv.index('--socket') + 1] if '--socket' in argv[:-1] else DEFAULT_SOCKET
+
+    tool_name = None
+    try:
+        event = json.loads(sys.stdin.read())
+        tool_name = event.get('tool_name')
+        value = (event.get('tool_input') or {}).get(FIELDS[check])
+    except (ValueError, AttributeError):
+        value = None
+
+    if value in (None, False, ''):
+        return 0  # Nothing to check, allow
+    if not isinstance(value, str):
+        value = json.dumps(value)
+
+    result = ask_daemon(socket_path, check, value, tool_name) or check_locally(check, value, tool_name)
+
+    if not result['allowed']:
+        stderr_line, error = MESSAGES[(check, result['reason'])]
+        print(stderr_line.format(value=value), file=sys.stderr)
+        print(json.dumps({'error': error}, indent=2))
+        return 2
+
+    if check == 'bash' and result['sensitive']:
+        log('security.log', 'SENSITIVE: [REDACTED - contained sensitive keywords]')
+    elif check == 'file':
+        log('file_access.log', 'FILE_ACCESS: ' + ''.join(c for c in value if c.isprintable()))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -4,9 +4,11 @@
 Shared security functions and validation logic
 """
 
+import os
 import re
 import json
-from typing import Dict, List, Optional, Any, Union
+import threading
+from typing import Dict, Iterator, List, Optional, Any, Tuple, Union
 from pathlib import Path
 
 
@@ -55,457 +57,5007 @@
 ]
 
 
-def detect_secrets(content: str) -> List[Dict[str, str]]:
+# Characters with special meaning in a regex; a literal prefix ends at the first one
+_REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+# Non-ASCII characters that IGNORECASE matches against an ASCII letter but that
+# str.lower() leaves alone; folded explicitly so literal prefixes still line up
+_CASE_FOLD_EXTRAS = {0x131: 'i', 0x17f: 's'}
+
+
+def _literal_prefixes(pattern: str) -> Optional[List[str]]:
     """
-    Detect potential secrets in content using regex patterns
+    Extract the lowercase literal prefixes every match of a pattern must start with
 
     Args:
-        content: String content to analyze
+        pattern: Regex pattern source
 
     Returns:
-        List of detected secrets with pattern and match info
+        List of alternative prefixes, or None when the pattern has no usable prefix
     """
-    detected_secrets = []
-
-    for pattern in SECRET_PATTERNS:
-        matches = re.finditer(pattern, content, re.MULTILINE)
-        for match in matches:
-            detected_secrets.append({
-                'pattern': pattern,
-                'match': match.group(0)[:50] + '...' if len(match.group(0)) > 50 else match.group(0),
-                'start': match.start(),
-                'end': match.end(),
-                'type': _classify_secret_type(pattern)
-            })
+    inline_flags = re.match(r'\(\?[aiLmsux]+\)', pattern)
+    if inline_flags:
+        pattern = pattern[inline_flags.end():]
 
-    return detected_secrets
+    # Leading group of plain alternatives, e.g. (mongodb|mysql|postgresql)
+    if pattern.startswith('('):
+        close = pattern.find(')')
+        body = pattern[1:close]
+        if body.startswith('?:'):
+            body = body[2:]
+        if close < 0 or '(' in body or pattern[close + 1:close + 2] in ('?', '*', '{'):
+            return None
+        try:
+            re.compile(body)
+        except re.error:
+            return None  # The first ')' was not the end of the group
 
+        prefixes = []
+        for alternative in body.split('|'):
+            alternative_prefixes = _literal_prefixes(alternative)
+            if alternative_prefixes is None:
+                return None
+            prefixes.extend(alternative_prefixes)
+        return prefixes
 
-def _classify_secret_type(pattern: str) -> str:
-    """Classify the type of secret based on the regex pattern"""
-    if 'api' in pattern.lower() or 'token' in pattern.lower():
-        return 'api_key'
-    elif 'password' in pattern.lower():
-        return 'password'
-    elif 'private key' in pattern.upper():
-        return 'private_key'
-    elif 'bearer' in pattern.lower():
-        return 'bearer_token'
-    elif 'aws' in pattern.lower():
-        return 'aws_credential'
-    elif 'jwt' in pattern.lower() or 'eyJ' in pattern:
-        return 'jwt_token'
-    else:
-        return 'unknown_secret'
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            char = pattern[i + 1]
+            step = 2
+        elif char in _REGEX_METACHARACTERS:
+            break
+        else:
+            step = 1
+        if pattern[i + step:i + step + 1] in ('?', '*', '{'):
+            break  # Quantified character is optional, so it cannot anchor the match
+        prefix.append(char)
+        i += step
 
+    return [''.join(prefix).lower()] if prefix else None
 
-def is_dangerous_file_path(file_path: str) -> bool:
-    """
-    Check if a file path is potentially dangerous to access
 
-    Args:
-        file_path: File path to check
+def _split_alternatives(body: str) -> Optional[List[str]]:
+    """Split a regex body on top-level '|', or None if it contains nested groups"""
+    alternatives = ['']
+    i = 0
+    in_class = False
+    while i < len(body):
+        char = body[i]
+        if char == '\\':
+            alternatives[-1] += body[i:i + 2]
+            i += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            if body[i + 1:i + 2] == ']':
+                alternatives[-1] += char
+                i += 1
+                char = ']'
+        elif char in '()':
+            return None
+        elif char == '|':
+            alternatives.append('')
+            i += 1
+            continue
+        alternatives[-1] += char
+        i += 1
+    return alternatives
 
-    Returns:
-        True if the path is dangerous, False otherwise
-    """
-    path_str = str(file_path).lower()
 
-    for pattern in DANGEROUS_FILE_PATTERNS:
-        if re.search(pattern, path_str, re.IGNORECASE):
+def _has_top_level_alternation(pattern: str) -> bool:
+    """Check whether a regex has a '|' outside of any group or character class"""
+    depth = 0
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            i += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            if pattern[i + 1:i + 2] == ']':
+                i += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
             return True
-
+        i += 1
     return False
 
 
-def validate_tool_input(tool_input: Any) -> Dict[str, Any]:
+def _required_literals(pattern: str) -> List[List[str]]:
     """
-    Validate and sanitize tool input
+    Extract literal groups that must all appear in any match of a pattern
+
+    Each group lists alternatives of which at least one occurs in the match,
+    e.g. ['api', 'password', 'secret', 'token'] followed by [':', '='].
+    Parts of the pattern that cannot be reduced to literals are skipped, so the
+    result is always a safe (if incomplete) set of requirements.
 
     Args:
-        tool_input: Raw tool input to validate
+        pattern: Regex pattern source
 
     Returns:
-        Validated tool input dictionary
-
-    Raises:
-        ValueError: If input is invalid or dangerous
+        List of any-of literal groups, in pattern case
     """
-    if not isinstance(tool_input, dict):
-        # Convert string inputs to dict format
-        if isinstance(tool_input, str):
-            try:
-                parsed = json.loads(tool_input)
-                if isinstance(parsed, dict):
-                    tool_input = parsed
-                else:
-                    tool_input = {'raw_input': tool_input}
-            except json.JSONDecodeError:
-                tool_input = {'raw_input': tool_input}
+    inline_flags = re.match(r'\(\?[aiLmsux]+\)', pattern)
+    if inline_flags:
+        pattern = pattern[inline_flags.end():]
+    if _has_top_level_alternation(pattern):
+        return []  # No part is required by every branch
+
+    groups = []
+    run = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        literals = None
+        if char == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped and not escaped.isalnum():
+                literals = [escaped]
+            end = i + 2
+        elif char == '[':
+            end = i + 1
+            if pattern[end:end + 1] in ('^', ']'):
+                end += 1
+            while end < len(pattern) and pattern[end] != ']':
+                end += 2 if pattern[end] == '\\' else 1
+            members = re.sub(r'\\(.)', r'\1', pattern[i + 1:end])
+            end += 1
+            if members and not members.startswith('^') and '-' not in members.strip('-') and len(members) <= 4:
+                literals = sorted(set(members))
+        elif char == '(':
+            depth = 0
+            end = i
+            while end < len(pattern):
+                if pattern[end] == '\\':
+                    end += 1
+                elif pattern[end] == '(':
+                    depth += 1
+                elif pattern[end] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                end += 1
+            body = pattern[i + 1:end]
+            end += 1
+            if body.startswith('?:'):
+                body = body[2:]
+            if not body.startswith('?'):
+                alternatives = _split_alternatives(body)
+                prefixes = [_literal_prefixes(alt) for alt in alternatives or []]
+                if prefixes and all(prefixes):
+                    literals = [prefix for group in prefixes for prefix in group]
+        elif char in '^$':
+            i += 1
+            continue
         else:
-            tool_input = {'raw_input': str(tool_input)}
+            literals = None if char in _REGEX_METACHARACTERS else [char]
+            end = i + 1
 
-    # Whitelist allowed keys for different tool types
-    ALLOWED_KEYS = {
-        'Bash': {'command', 'description', 'timeout'},
-        'Read': {'file_path', 'limit', 'offset'},
-        'Write': {'file_path', 'content'},
-        'Edit': {'file_path', 'old_string', 'new_string', 'replace_all'},
-        'MultiEdit': {'file_path', 'edits'},
-        'Grep': {'pattern', 'path', 'glob', 'type', 'output_mode', '-i', '-n', '-A', '-B', '-C'},
-        'Glob': {'pattern', 'path'},
-        'LS': {'path', 'ignore'},
-    }
+        # Apply the quantifier, if any
+        quantifier = pattern[end:end + 1]
+        optional = quantifier in ('?', '*') or (quantifier == '{' and pattern[end + 1:end + 2] in (',', '0'))
+        repeated = quantifier in ('+', '{')
+        if quantifier in ('?', '*', '+'):
+            end += 1
+        elif quantifier == '{':
+            end = pattern.index('}', end) + 1
+        if pattern[end:end + 1] == '?':
+            end += 1  # Lazy quantifier
 
-    # Get tool name from input or environment
-    tool_name = tool_input.get('tool_name', 'unknown')
+        if literals is not None and not optional and len(literals) == 1 and not repeated:
+            run += literals[0]
+            i = end
+            continue
+        if run:
+            groups.append([run])
+            run = ''
+        if literals is not None and not optional:
+            if repeated and len(literals) == 1:
+                run = literals[0]  # Repeated literal still occurs at least once
+            else:
+                groups.append(literals)
+        i = end
 
-    # Validate keys against whitelist
-    if tool_name in ALLOWED_KEYS:
-        allowed = ALLOWED_KEYS[tool_name]
-        invalid_keys = set(tool_input.keys()) - allowed - {'tool_name', 'raw_input'}
-        if invalid_keys:
-            raise ValueError(f"Invalid keys for {tool_name}: {invalid_keys}")
-
-    # Check for secrets in string values
-    for key, value in tool_input.items():
-        if isinstance(value, str):
-            secrets = detect_secrets(value)
-            if secrets:
-                raise ValueError(f"Potential secret detected in {key}: {secrets[0]['type']}")
-
-    # Validate file paths
-    if 'file_path' in tool_input:
-        file_path = tool_input['file_path']
-        if is_dangerous_file_path(file_path):
-            raise ValueError(f"Access to dangerous file path blocked: {file_path}")
+    if run:
+        groups.append([run])
+    return groups
 
-    return tool_input
 
+# Characters ordered from most to least common in source text and logs;
+# anything not listed (digits, punctuation, uppercase) counts as rarest
+_COMMON_CHARACTERS = ' etaoinsrhldcumfpgwybvkxjqz'
 
-def sanitize_output(output: str, max_length: int = 10000) -> str:
-    """
-    Sanitize output by removing potential secrets and limiting length
+# Characters that str.lower() (plus _CASE_FOLD_EXTRAS) maps onto an ASCII letter
+_FOLD_PREIMAGE_EXTRAS = {'i': '\u0130\u0131', 'k': '\u212a', 's': '\u017f'}
 
-    Args:
-        output: Raw output to sanitize
-        max_length: Maximum length of output
 
-    Returns:
-        Sanitized output string
-    """
-    if not isinstance(output, str):
-        output = str(output)
+def _rarest_character(literal: str) -> str:
+    """Pick the character of a literal least likely to occur in ordinary text"""
+    return max(
+        literal,
+        key=lambda char: _COMMON_CHARACTERS.find(char) if char in _COMMON_CHARACTERS else len(_COMMON_CHARACTERS)
+    )
 
-    # Truncate if too long
-    if len(output) > max_length:
-        output = output[:max_length] + '\n... [TRUNCATED FOR SECURITY]'
 
-    # Replace potential secrets with placeholders
-    secrets = detect_secrets(output)
-    for secret in secrets:
-        secret_type = secret['type']
-        placeholder = f'[{secret_type.upper()}_REDACTED]'
-        output = output.replace(secret['match'], placeholder)
+def _fold_preimages(char: str) -> str:
+    """Get every character that case-folds to the given lowercase character"""
+    return char + char.upper() + _FOLD_PREIMAGE_EXTRAS.get(char, '') if char.upper() != char else char
 
-    return output
 
+def _case_fold(content: str):
+    """
+    Lowercase content for literal matching without shifting offsets
 
-def create_security_log_entry(
-    tool_name: str,
-    tool_input: Any,
-    action: str,
-    details: Optional[Dict[str, Any]] = None
-) -> Dict[str, Any]:
+    Returns:
+        Folded string, or False if folding changed the length of the content
     """
-    Create a standardized security log entry
+    folded = content.lower()
+    if len(folded) != len(content):
+        return False
+    if not folded.isascii() and any(chr(c) in folded for c in _CASE_FOLD_EXTRAS):
+        folded = folded.translate(_CASE_FOLD_EXTRAS)
+    return folded
 
-    Args:
-        tool_name: Name of the tool being used
-        tool_input: Input provided to the tool
-        action: Action taken (e.g., 'blocked', 'allowed', 'sanitized')
-        details: Additional details about the security action
 
-    Returns:
-        Security log entry dictionary
+class SecretScanner:
     """
-    from datetime import datetime
+    Compiled secret detection engine
 
-    log_entry = {
-        'timestamp': datetime.now().isoformat(),
-        'tool_name': tool_name,
-        'action': action,
-        'input_hash': hash(str(tool_input)) if tool_input else None,
-    }
+    A prefilter first checks the literals each pattern requires (e.g. 'AKIA',
+    '-----BEGIN ', a keyword followed by ':' or '='), so patterns that cannot
+    match are dropped without touching the regex engine. The remaining patterns
+    are merged into one search over their literal prefixes, so the content is
+    scanned once; every candidate position is then confirmed with the exact
+    pattern. Findings are identical to running re.finditer per pattern.
+    """
 
-    if details:
-        log_entry['details'] = details
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+        self._compiled = [re.compile(pattern, re.MULTILINE) for pattern in self.patterns]
+        self._types = [_classify_secret_type(pattern) for pattern in self.patterns]
 
-    # Sanitize the input before logging
-    if isinstance(tool_input, dict):
-        sanitized_input = {}
-        for key, value in tool_input.items():
-            if isinstance(value, str) and detect_secrets(value):
-                sanitized_input[key] = '[REDACTED_FOR_SECURITY]'
-            else:
-                sanitized_input[key] = value
-        log_entry['tool_input'] = sanitized_input
-    else:
-        log_entry['tool_input'] = '[REDACTED_FOR_SECURITY]' if detect_secrets(str(tool_input)) else str(tool_input)[:200]
+        # Required literals per pattern, split into groups that can be checked
+        # against the raw content and groups that need the case-folded content
+        self._gates = []
+        for index, pattern in enumerate(self.patterns):
+            ignore_case = bool(self._compiled[index].flags & re.IGNORECASE)
+            exact_groups = []
+            folded_groups = []
+            for group in _required_literals(pattern):
+                if ignore_case and any(literal.lower() != literal.upper() for literal in group):
+                    folded_groups.append(tuple(literal.lower() for literal in group))
+                else:
+                    exact_groups.append(tuple(group))
+            self._gates.append((exact_groups, folded_groups))
 
-    return log_entry
+        # Patterns without a literal prefix are scanned on their own
+        self._unanchored = []
+        self._prefixes = {}
+        for index, pattern in enumerate(self.patterns):
+            literals = _literal_prefixes(pattern)
+            if literals is None:
+                self._unanchored.append(index)
+                continue
+            for literal in literals:
+                self._prefixes.setdefault(literal, []).append(index)
 
-# Enhanced system directory protection
-SYSTEM_DIRECTORY_PATTERNS = [
-    r'^/etc/',           # System configuration
-    r'^/root/',          # Root home directory
-    r'^/var/log/',       # System logs
-    r'^/boot/',          # Boot files
-    r'^/sys/',           # System filesystem
-    r'^/proc/',          # Process filesystem
-    r'^/dev/',           # Device files
-    r'^/usr/bin/',       # System binaries
-    r'^/usr/sbin/',      # System admin binaries
-    r'^/lib/',           # System libraries
-    r'^/lib64/',         # 64-bit system libraries
-    r'\.dll$',           # Windows DLLs
-    r'\.exe$',           # Windows executables
-    r'\.scr$',           # Screen savers (potential malware)
-    r'\.msi$',           # Windows installers
-    r'\.bat$',           # Batch files (potential command injection)
-    r'\.cmd$',           # Command files
-    r'\.ps1$',           # PowerShell scripts
-]
+        self._anchors = {}
+        self._byte_compiled = None
 
-# Rate limiting storage
-_rate_limit_storage = {}
-_rate_limit_cleanup_time = None
+    def scan(self, content: str, starts: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Scan content once and return findings grouped in pattern order
 
+        Args:
+            content: String content to analyze
+            starts: Optional per-pattern offsets to start matching from, used to
+                continue a previous scan without re-matching inside its findings
 
-def enhanced_is_dangerous_file_path(file_path: str) -> bool:
-    """
-    Enhanced file path validation with comprehensive system directory protection
-    """
-    from pathlib import Path
-    import os
+        Returns:
+            List of findings with pattern, match, start, end and type
+        """
+        active, folded = self._prefilter(content)
+        if not active:
+            return []
 
-    # Normalize path for consistent checking
-    try:
-        normalized_path = str(Path(file_path).resolve())
-    except (OSError, ValueError):
-        return True
+        if folded is None:
+            folded = _case_fold(content)
+        if folded is False:
+            # Case folding changed offsets; fall back to one pass per pattern
+            return self._scan_each(content, active, starts)
 
-    path_str = normalized_path.lower()
+        found = {index: [] for index in active}
+        resume = {index: (starts or {}).get(self.patterns[index], 0) for index in active}
+        anchor, candidates = self._anchor_for(active)
 
-    # Check against original dangerous patterns
-    for pattern in DANGEROUS_FILE_PATTERNS:
-        if re.search(pattern, path_str, re.IGNORECASE):
-            return True
+        if anchor is not None:
+            search = anchor.search
+            hit = search(folded)
+            while hit:
+                start = hit.start()
+                tried = set()
+                for literal, indexes in candidates[folded[start]]:
+                    if not folded.startswith(literal, start):
+                        continue
+                    for index in indexes:
+                        # Mirror finditer: never restart inside this pattern's last match
+                        if index in tried or resume[index] > start:
+                            continue
+                        tried.add(index)
+                        match = self._compiled[index].match(content, start)
+                        if match:
+                            found[index].append(match)
+                            resume[index] = max(match.end(), start + 1)
+                hit = search(folded, start + 1)
 
-    # Check against enhanced system directory patterns
-    for pattern in SYSTEM_DIRECTORY_PATTERNS:
-        if re.search(pattern, normalized_path, re.IGNORECASE):
-            return True
+        for index in self._unanchored:
+            if index in found:
+                found[index] = list(self._compiled[index].finditer(content, resume[index]))
 
-    # Block access to parent directories using ..
-    if "../" in file_path or "..\\" in file_path:
-        return True
+        return [
+            self._finding(index, match)
+            for index in active
+            for match in found[index]
+        ]
 
-    # Block access to hidden system files
-    path_parts = Path(file_path).parts
-    for part in path_parts:
-        if part.startswith('.') and part in ['.env', '.git', '.ssh', '.aws', '.docker']:
-            return True
+    def _prefilter(self, content: str):
+        """
+        Find the patterns whose required literals all occur in the content
 
-    # Block access outside of allowed directories
-    try:
-        cwd = Path.cwd().resolve()
-        target_path = Path(file_path).resolve()
+        Each literal is first probed by its rarest character, a single memchr
+        pass, so clean content is usually rejected without any substring search.
+        The content is only case-folded if a case-insensitive literal survives
+        its probe.
 
-        # Check if target is within current working directory
-        try:
-            target_path.relative_to(cwd)
-        except ValueError:
-            return True
+        Returns:
+            Tuple of (active pattern indexes, folded content or None if not computed)
+        """
+        present = {}
+        folded = None
+        active = []
 
-    except (OSError, ValueError):
-        return True
+        for index, (exact_groups, folded_groups) in enumerate(self._gates):
+            passed = True
+            for group in exact_groups:
+                if group not in present:
+                    present[group] = any(
+                        _rarest_character(literal) in content and literal in content
+                        for literal in group
+                    )
+                if not present[group]:
+                    passed = False
+                    break
+            for group in folded_groups if passed else ():
+                key = ('folded', group)
+                if key not in present:
+                    probed = [
+                        literal for literal in group
+                        if any(char in content for char in _fold_preimages(_rarest_character(literal)))
+                    ]
+                    if probed and folded is None:
+                        folded = _case_fold(content)
+                    # Folding that shifts offsets proves nothing, so keep the pattern
+                    present[key] = bool(probed) and (
+                        folded is False or any(literal in folded for literal in probed)
+                    )
+                if not present[key]:
+                    passed = False
+                    break
+            if passed:
+                active.append(index)
 
-    return False
+        return active, folded
 
+    def _anchor_for(self, active: List[int]):
+        """Get the combined prefix search and dispatch table for a set of patterns"""
+        key = tuple(active)
+        if key not in self._anchors:
+            enabled = set(active)
+            candidates = {}
+            literals = []
+            for literal, indexes in self._prefixes.items():
+                indexes = [index for index in indexes if index in enabled]
+                if indexes:
+                    literals.append(literal)
+                    candidates.setdefault(literal[0], []).append((literal, indexes))
 
-def check_rate_limit(identifier: str, max_requests: int = 10, window_seconds: int = 60) -> bool:
-    """
-    Check if an operation is within rate limits
-    """
-    import time
-    global _rate_limit_storage, _rate_limit_cleanup_time
+            anchor = None
+            if literals:
+                ordered = sorted(literals, key=len, reverse=True)
+                anchor = re.compile('|'.join(re.escape(literal) for literal in ordered))
 
-    current_time = time.time()
+            if len(self._anchors) >= 64:
+                self._anchors.clear()
+            self._anchors[key] = (anchor, candidates)
 
-    # Cleanup old entries every 5 minutes
-    if _rate_limit_cleanup_time is None or (current_time - _rate_limit_cleanup_time) > 300:
-        cleanup_time = current_time - window_seconds * 2
-        _rate_limit_storage = {
-            k: [t for t in timestamps if t > cleanup_time]
-            for k, timestamps in _rate_limit_storage.items()
-            if any(t > cleanup_time for t in timestamps)
-        }
-        _rate_limit_cleanup_time = current_time
+        return self._anchors[key]
 
-    # Initialize or get existing timestamps for this identifier
-    if identifier not in _rate_limit_storage:
-        _rate_limit_storage[identifier] = []
+    def _scan_each(self, content: str, indexes, starts: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """Run each pattern separately, as detect_secrets originally did"""
+        starts = starts or {}
+        return [
+            self._finding(index, match)
+            for index in indexes
+            for match in self._compiled[index].finditer(content, starts.get(self.patterns[index], 0))
+        ]
 
-    timestamps = _rate_limit_storage[identifier]
+    def scan_buffer(self, buffer: Any) -> List[Dict[str, Any]]:
+        """
+        Scan a bytes-like buffer (bytes, mmap, memoryview) without decoding it
 
-    # Remove timestamps outside the window
-    cutoff_time = current_time - window_seconds
-    timestamps = [t for t in timestamps if t > cutoff_time]
+        Patterns are compiled in bytes mode, so case-insensitive matching and
+        \\s only cover ASCII, and offsets are byte offsets. The same literal
+        gates as scan() run first, using buffer.find so nothing is copied.
 
-    # Check if we are within limits
-    if len(timestamps) >= max_requests:
-        return False  # Rate limited
+        Args:
+            buffer: Bytes-like object supporting find()
 
-    # Add current timestamp
-    timestamps.append(current_time)
-    _rate_limit_storage[identifier] = timestamps
+        Returns:
+            List of findings with pattern, match, start, end and type
+        """
+        if self._byte_compiled is None:
+            self._byte_compiled = [
+                re.compile(pattern.encode('utf-8'), self._compiled[index].flags & ~re.UNICODE)
+                for index, pattern in enumerate(self.patterns)
+            ]
 
-    return True  # Not rate limited
+        def contains(literal: str, ignore_case: bool) -> bool:
+            data = literal.encode('utf-8')
+            if not ignore_case:
+                return buffer.find(data) != -1
+            probe = _rarest_character(literal)
+            if buffer.find(probe.encode('utf-8')) == -1 and buffer.find(probe.upper().encode('utf-8')) == -1:
+                return False
+            return re.search(re.escape(data), buffer, re.IGNORECASE) is not None
 
+        present = {}
+        active = []
+        for index, (exact_groups, folded_groups) in enumerate(self._gates):
+            gates = [(group, False) for group in exact_groups] + [(group, True) for group in folded_groups]
+            passed = True
+            for group, ignore_case in gates:
+                if (group, ignore_case) not in present:
+                    present[group, ignore_case] = any(contains(literal, ignore_case) for literal in group)
+                if not present[group, ignore_case]:
+                    passed = False
+                    break
+            if passed:
+                active.append(index)
+        if not active:
+            return []
 
-def get_secure_timeout(operation_type: str) -> int:
-    """
-    Get secure timeout value for different operations
-    """
-    timeout_config = {
-        'bash': 60,          # 1 minute for bash commands
-        'read': 30,          # 30 seconds for file reads
-        'write': 45,         # 45 seconds for file writes
-        'edit': 60,          # 1 minute for file edits
-        'grep': 30,          # 30 seconds for searches
-        'glob': 20,          # 20 seconds for file globbing
-        'ls': 15,            # 15 seconds for directory listings
-        'git': 120,          # 2 minutes for git operations
-        'test': 300,         # 5 minutes for test execution
-        'build': 600,        # 10 minutes for builds
-        'default': 60        # Default 1 minute
-    }
+        found = {index: [] for index in active}
+        resume = dict.fromkeys(active, 0)
+        anchor, candidates = self._anchor_for(active)
 
-    return timeout_config.get(operation_type.lower(), timeout_config['default'])
+        if anchor is not None:
+            # Prefix hits are found on lowercased windows of at most
+            # BUFFER_FOLD_WINDOW bytes; matches are confirmed on the buffer itself
+            search = re.compile(anchor.pattern.encode('utf-8')).search
+            candidates = {
+                ord(first): [(literal.encode('utf-8'), indexes) for literal, indexes in entries]
+                for first, entries in candidates.items()
+            }
+            longest = max(len(literal) for entries in candidates.values() for literal, _ in entries)
+            size = len(buffer)
+            for window_start in range(0, size, BUFFER_FOLD_WINDOW):
+                window_end = min(window_start + BUFFER_FOLD_WINDOW, size)
+                window = buffer[window_start:window_end + longest - 1].lower()
+                hit = search(window)
+                while hit and hit.start() < window_end - window_start:
+                    offset = hit.start()
+                    start = window_start + offset
+                    tried = set()
+                    for literal, indexes in candidates[window[offset]]:
+                        if not window.startswith(literal, offset):
+                            continue
+                        for index in indexes:
+                            if index in tried or resume[index] > start:
+                                continue
+                            tried.add(index)
+                            match = self._byte_compiled[index].match(buffer, start)
+                            if match:
+                                found[index].append(match)
+                                resume[index] = max(match.end(), start + 1)
+                    hit = search(window, offset + 1)
 
+        for index in self._unanchored:
+            if index in found:
+                found[index] = list(self._byte_compiled[index].finditer(buffer))
 
-def create_secure_config() -> Dict[str, Any]:
+        return [
+            self._finding(index, match)
+            for index in active
+            for match in found[index]
+        ]
+
+    def _finding(self, index: int, match: 're.Match') -> Dict[str, Any]:
+        """Build a finding dictionary from a pattern match"""
+        text = match.group(0)
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', errors='replace')
+        return {
+            'pattern': self.patterns[index],
+            'match': text[:50] + '...' if len(text) > 50 else text,
+            'start': match.start(),
+            'end': match.end(),
+            'type': self._types[index]
+        }
+
+
+_secret_scanner: Optional[SecretScanner] = None
+
+# Several patterns are unbounded ([^"'\s]+ and friends), so streaming scans cap
+# the longest match they guarantee to find across a chunk boundary
+STREAM_MAX_MATCH_LENGTH = 4096
+
+# Files with a NUL byte in this many leading bytes are treated as binary
+BINARY_SNIFF_BYTES = 8192
+
+# Directories scan_tree never descends into
+SCAN_TREE_PRUNED_DIRS = {'.git', 'node_modules', '.next'}
+
+# Bump when the ScanCache layout or finding format changes
+SCAN_CACHE_VERSION = 1
+
+# Bytes of a mapped buffer lowercased at a time to search for pattern prefixes
+BUFFER_FOLD_WINDOW = 1024 * 1024
+
+# Memory budget of the detect_secrets memo
+DETECTION_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+
+def get_secret_scanner() -> SecretScanner:
     """
-    Create secure configuration with proper defaults
+    Get the shared scanner for SECRET_PATTERNS, recompiling it if the patterns change
     """
-    return {
-        'max_file_size': 10 * 1024 * 1024,  # 10MB max file size
-        'max_output_length': 50000,          # 50K characters max output
-        'max_log_entries': 1000,             # Max log entries before rotation
-        'rate_limit_requests': 20,           # Max requests per minute
-        'rate_limit_window': 60,             # Rate limit window in seconds
-        'allowed_extensions': [
-            '.py', '.js', '.ts', '.go', '.rs', '.rb', '.java', '.cpp', '.c',
-            '.h', '.hpp', '.css', '.html', '.md', '.txt', '.json', '.yaml',
-            '.yml', '.toml', '.ini', '.cfg', '.conf', '.sh', '.bat'
-        ],
-        'blocked_extensions': [
-            '.exe', '.dll', '.so', '.dylib', '.msi', '.deb', '.rpm',
-            '.dmg', '.pkg', '.app', '.scr', '.com', '.pif'
-        ],
-        'secure_headers': {
-            'User-Agent': 'Claude-Code-Security/1.0',
-            'X-Security-Version': '1.0'
-        }
-    }
+    global _secret_scanner
+
+    if _secret_scanner is None or _secret_scanner.patterns != SECRET_PATTERNS:
+        _secret_scanner = SecretScanner(SECRET_PATTERNS)
 
+    return _secret_scanner
 
-def rotate_log_file(log_file_path: str, max_entries: int = 1000) -> bool:
+
+class DetectionCache:
     """
-    Rotate log file when it gets too large
+    LRU memo of detect_secrets results keyed by a blake2b digest of the content
+
+    The cache is bounded by an estimate of the bytes it holds rather than by
+    entry count, so a few results with many findings cannot crowd out memory.
+    Hit and miss counters show how many repeated scans were avoided.
     """
-    from pathlib import Path
-    import json
-    import shutil
-    from datetime import datetime
 
-    log_path = Path(log_file_path)
+    def __init__(self, max_bytes: int = DETECTION_CACHE_MAX_BYTES):
+        from collections import OrderedDict
 
-    if not log_path.exists():
-        return False
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
 
-    # Count entries in log file
-    try:
-        with open(log_path, 'r') as f:
-            lines = f.readlines()
+    @staticmethod
+    def key(content: str) -> bytes:
+        """Digest content into a cache key"""
+        import hashlib
 
-        if len(lines) <= max_entries:
-            return False  # No rotation needed
+        return hashlib.blake2b(content.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
 
-        # Create backup with timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = log_path.with_suffix(f'.{timestamp}.backup')
+    @staticmethod
+    def _entry_size(findings: List[Dict[str, Any]]) -> int:
+        """Estimate the memory held by a cached entry"""
+        return 128 + sum(256 + len(finding['match']) for finding in findings)
 
-        # Move current log to backup
-        shutil.move(str(log_path), str(backup_path))
+    def get(self, key: bytes) -> Optional[List[Dict[str, Any]]]:
+        """Get a copy of cached findings, counting the hit or miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return [dict(finding) for finding in entry[0]]
 
-        # Keep only recent entries in new log file
-        recent_entries = lines[-max_entries//2:]  # Keep last half
+    def put(self, key: bytes, findings: List[Dict[str, Any]]) -> None:
+        """Store findings, evicting least recently used entries over max_bytes"""
+        size = self._entry_size(findings)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        self._entries[key] = ([dict(finding) for finding in findings], size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
 
-        with open(log_path, 'w') as f:
-            f.writelines(recent_entries)
+    def clear(self) -> None:
+        """Drop all entries (counters are kept)"""
+        self._entries.clear()
+        self.bytes = 0
 
-        # Add rotation log entry
-        rotation_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'action': 'log_rotation',
-            'entries_before': len(lines),
-            'entries_after': len(recent_entries),
-            'backup_file': str(backup_path)
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss counters and current size"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
         }
 
-        with open(log_path, 'a') as f:
-            f.write(json.dumps(rotation_entry) + '\n')
 
-        # Clean up old backups (keep only last 5)
-        backup_pattern = log_path.stem + '.*' + '.backup'
-        parent_dir = log_path.parent
-        backups = sorted(parent_dir.glob(backup_pattern))
+_detection_cache = DetectionCache()
+_detection_cache_scanner: Optional[SecretScanner] = None
 
-        if len(backups) > 5:
-            for old_backup in backups[:-5]:
-                old_backup.unlink()
 
-        return True
+def get_detection_cache_stats() -> Dict[str, int]:
+    """
+    Get hit/miss counters of the detect_secrets memo
+    """
+    return _detection_cache.stats()
 
-    except (IOError, json.JSONDecodeError, OSError) as e:
-        # If rotation fails, log the error but don't crash
-        try:
-            error_entry = {
-                'timestamp': datetime.now().isoformat(),
-                'action': 'log_rotation_error',
-                'error': str(e)
-            }
-            with open(log_path, 'a') as f:
-                f.write(json.dumps(error_entry) + '\n')
-        except:
-            pass  # If we cannot even log the error, just continue
 
-        return False
+def clear_detection_cache() -> None:
+    """
+    Drop memoized detect_secrets results (counters are kept)
+    """
+    _detection_cache.clear()
 
 
-def setup_log_rotation_for_all_logs() -> None:
-    """
-    Set up log rotation for all log files in the logs directory
+def detect_secrets(content: str) -> List[Dict[str, str]]:
     """
-    from pathlib import Path
+    Detect potential secrets in content using regex patterns
 
-    logs_dir = Path(__file__).parent / 'logs'
-    if not logs_dir.exists():
-        return
+    Results are memoized by content digest, so scanning the same value again
+    within a hook invocation (validation, logging, output sanitizing) is free.
+
+    Args:
+        content: String content to analyze
+
+    Returns:
+        List of detected secrets with pattern and match info
+    """
+    global _detection_cache_scanner
+
+    scanner = get_secret_scanner()
+    if scanner is not _detection_cache_scanner:
+        # SECRET_PATTERNS changed, so cached results are stale
+        _detection_cache.clear()
+        _detection_cache_scanner = scanner
+
+    key = _detection_cache.key(content)
+    findings = _detection_cache.get(key)
+    if findings is None:
+        findings = scanner.scan(content)
+        _detection_cache.put(key, findings)
+    return findings
+
+
+# Per-charset entropy thresholds in bits per character, with the minimum token
+# length considered. Hex tops out at 4 bits/char and base64 at 6.
+DEFAULT_ENTROPY_THRESHOLDS = {
+    'hex': {'min_length': 32, 'threshold': 3.0},
+    'base64': {'min_length': 20, 'threshold': 4.5},
+}
+
+_HEX_TOKEN = re.compile(r'[0-9a-fA-F]+')
+
+_numpy = None
+
+
+def _load_numpy():
+    """Import NumPy on first use; returns None when it is not installed"""
+    global _numpy
+
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+def _batch_entropy(tokens: List[str]) -> List[float]:
+    """
+    Compute the Shannon entropy of many ASCII tokens at once
+
+    With NumPy, all tokens are packed into one byte array and a single
+    bincount builds every per-token byte histogram. Without it, each token is
+    counted by collections.Counter, which still counts in C.
+    """
+    import math
+
+    if not tokens:
+        return []
+
+    np = _load_numpy()
+    if np is None:
+        from collections import Counter
+
+        entropies = []
+        for token in tokens:
+            length = len(token)
+            entropies.append(-sum(
+                count / length * math.log2(count / length)
+                for count in Counter(token).values()
+            ))
+        return entropies
+
+    entropies = []
+    batch_size = 4096  # Keeps the histogram matrix at batch_size x 256
+    for offset in range(0, len(tokens), batch_size):
+        batch = tokens[offset:offset + batch_size]
+        data = np.frombuffer(''.join(batch).encode('ascii'), dtype=np.uint8)
+        lengths = np.fromiter((len(token) for token in batch), dtype=np.int64, count=len(batch))
+        token_ids = np.repeat(np.arange(len(batch), dtype=np.int64), lengths)
+        histograms = np.bincount(token_ids * 256 + data, minlength=len(batch) * 256).reshape(len(batch), 256)
+        probabilities = histograms / lengths[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(probabilities > 0, probabilities * np.log2(probabilities), 0.0)
+        entropies.extend((-terms.sum(axis=1)).tolist())
+    return entropies
+
+
+class EntropyDetector:
+    """
+    Detector tier for random-looking tokens that no keyword pattern catches
+
+    Content is tokenized into runs of base64/hex characters, every candidate is
+    scored in one batch, and tokens above their charset's threshold are reported.
+    """
+
+    def __init__(self, thresholds: Optional[Dict[str, Dict[str, float]]] = None):
+        self.thresholds = {
+            charset: dict(DEFAULT_ENTROPY_THRESHOLDS[charset], **(thresholds or {}).get(charset, {}))
+            for charset in DEFAULT_ENTROPY_THRESHOLDS
+        }
+        shortest = int(min(limits['min_length'] for limits in self.thresholds.values()))
+        self._tokens = re.compile(r'[A-Za-z0-9+/_\-]{%d,}={0,2}' % shortest)
+
+    def scan(self, content: str) -> List[Dict[str, Any]]:
+        """
+        Find high-entropy tokens in content
+
+        Args:
+            content: String content to analyze
+
+        Returns:
+            List of findings with pattern, match, start, end and type
+        """
+        candidates = []
+        for match in self._tokens.finditer(content):
+            token = match.group(0)
+            charset = 'hex' if _HEX_TOKEN.fullmatch(token) else 'base64'
+            if len(token) >= self.thresholds[charset]['min_length']:
+                candidates.append((match, charset))
+
+        entropies = _batch_entropy([match.group(0) for match, _ in candidates])
+
+        findings = []
+        for (match, charset), entropy in zip(candidates, entropies):
+            if entropy < self.thresholds[charset]['threshold']:
+                continue
+            token = match.group(0)
+            findings.append({
+                'pattern': f'entropy:{charset}',
+                'match': token[:50] + '...' if len(token) > 50 else token,
+                'start': match.start(),
+                'end': match.end(),
+                'type': f'high_entropy_{charset}'
+            })
+        return findings
+
+
+def detect_high_entropy_strings(
+    content: str,
+    thresholds: Optional[Dict[str, Dict[str, float]]] = None
+) -> List[Dict[str, str]]:
+    """
+    Detect random-looking tokens (keys, hashes, tokens without a keyword)
+
+    Args:
+        content: String content to analyze
+        thresholds: Per-charset overrides, e.g. {'hex': {'threshold': 3.2}};
+            defaults come from create_secure_config()['entropy_thresholds']
+
+    Returns:
+        List of detected tokens in the same shape as detect_secrets
+    """
+    if thresholds is None:
+        thresholds = create_secure_config()['entropy_thresholds']
+    return EntropyDetector(thresholds).scan(content)
+
+
+def _iter_stream_segments(
+    fileobj: Any,
+    chunk_size: int,
+    overlap: int
+) -> Iterator[Tuple[str, int, List[Dict[str, Any]]]]:
+    """
+    Read a stream in chunks and yield each finalized segment with its findings
+
+    Yields:
+        Tuples of (segment text, absolute offset of the segment, findings that
+        start inside the segment sorted by start, with absolute offsets)
+    """
+    import codecs
+
+    scanner = get_secret_scanner()
+    decoder = None
+    buffer = ''
+    base = 0     # Absolute offset of buffer[0]
+    resume = {}  # Pattern -> absolute end of its last reported match
+
+    while True:
+        chunk = fileobj.read(chunk_size)
+        eof = not chunk
+        if isinstance(chunk, bytes):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            chunk = decoder.decode(chunk, final=eof)
+        elif eof and decoder is not None:
+            chunk = decoder.decode(b'', final=True)
+        buffer += chunk
+
+        # Matches starting in the overlap tail are reported with the next chunk
+        limit = len(buffer) if eof else len(buffer) - overlap
+        if limit > 0:
+            # Each pattern continues after its last reported match, as finditer would
+            starts = {pattern: end - base for pattern, end in resume.items() if end > base}
+            findings = sorted(
+                (f for f in scanner.scan(buffer, starts) if f['start'] < limit),
+                key=lambda f: f['start']
+            )
+            for finding in findings:
+                finding['start'] += base
+                finding['end'] += base
+                resume[finding['pattern']] = finding['end']
+            yield buffer[:limit], base, findings
+
+            buffer = buffer[limit:]
+            base += limit
+
+        if eof:
+            break
+
+
+def iter_secrets_stream(
+    fileobj: Any,
+    chunk_size: int = 1024 * 1024,
+    overlap: int = STREAM_MAX_MATCH_LENGTH
+) -> Iterator[Dict[str, Any]]:
+    """
+    Detect secrets in a file-like object without loading it into memory
+
+    The stream is read in chunks and each chunk is scanned together with the
+    tail of the previous one, so a secret crossing a chunk boundary is still
+    found. Memory use is bounded by chunk_size + overlap regardless of input size.
+    Binary streams are decoded as UTF-8 and offsets count decoded characters.
+
+    Args:
+        fileobj: Readable object returning str or bytes from read(size)
+        chunk_size: Number of characters or bytes read per call
+        overlap: Longest match guaranteed to be found across a chunk boundary
+
+    Yields:
+        Detected secrets with absolute start/end offsets, in stream order
+    """
+    for _, _, findings in _iter_stream_segments(fileobj, chunk_size, overlap):
+        yield from findings
+
+
+def _redact_segment(
+    segment: str,
+    base: int,
+    findings: List[Dict[str, Any]],
+    covered: int
+) -> Tuple[List[str], int]:
+    """
+    Replace finding spans in one segment of text with placeholders
+
+    Overlapping or adjacent-by-overlap spans are merged into a single placeholder
+    named after the first finding. covered is the absolute offset up to which
+    text is already redacted, which lets a span continue into later segments.
+
+    Args:
+        segment: Text of the segment
+        base: Absolute offset of the segment
+        findings: Findings starting in the segment, sorted by start
+        covered: Absolute end of the last redacted span
+
+    Returns:
+        Tuple of (output pieces, updated covered offset)
+    """
+    pieces = []
+    cursor = base
+    for finding in findings:
+        if finding['start'] < covered:
+            covered = max(covered, finding['end'])
+            continue
+        pieces.append(segment[max(cursor, covered) - base:finding['start'] - base])
+        pieces.append(f"[{finding['type'].upper()}_REDACTED]")
+        cursor = finding['start']
+        covered = finding['end']
+
+    start = max(cursor, covered)
+    if start < base + len(segment):
+        pieces.append(segment[start - base:])
+    return pieces, covered
+
+
+def redact_secrets(content: str, findings: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    Replace every detected secret span with a placeholder in a single pass
+
+    Args:
+        content: Text to redact
+        findings: Findings from detect_secrets(content), detected if omitted
+
+    Returns:
+        Redacted text
+    """
+    if findings is None:
+        findings = detect_secrets(content)
+    if not findings:
+        return content
+
+    pieces, _ = _redact_segment(content, 0, sorted(findings, key=lambda f: f['start']), 0)
+    return ''.join(pieces)
+
+
+def iter_redacted_stream(
+    fileobj: Any,
+    chunk_size: int = 1024 * 1024,
+    overlap: int = STREAM_MAX_MATCH_LENGTH
+) -> Iterator[str]:
+    """
+    Redact secrets from a file-like object chunk by chunk
+
+    Streaming counterpart of redact_secrets for outputs too large to hold in
+    memory (e.g. beyond create_secure_config()['max_output_length']).
+
+    Args:
+        fileobj: Readable object returning str or bytes from read(size)
+        chunk_size: Number of characters or bytes read per call
+        overlap: Longest match guaranteed to be found across a chunk boundary
+
+    Yields:
+        Redacted text pieces which concatenate to the redacted stream
+    """
+    covered = 0
+    for segment, base, findings in _iter_stream_segments(fileobj, chunk_size, overlap):
+        pieces, covered = _redact_segment(segment, base, findings, covered)
+        if pieces:
+            yield ''.join(pieces)
+
+
+def scan_file(path: Union[str, Path], max_file_size: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Detect secrets in a file by memory-mapping it instead of reading it
+
+    The mapped pages are scanned directly with bytes-mode patterns, so the file
+    is never copied or decoded. Binary files (a NUL byte in the first 8 KiB),
+    empty files and files above max_file_size are skipped.
+
+    Args:
+        path: File to scan
+        max_file_size: Size limit in bytes, defaults to create_secure_config()
+
+    Returns:
+        List of detected secrets with byte offsets, empty if the file was skipped
+    """
+    import mmap
+
+    if max_file_size is None:
+        max_file_size = create_secure_config()['max_file_size']
+
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or size > max_file_size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if mapped.find(b'\0', 0, BINARY_SNIFF_BYTES) != -1:
+                    return []
+                return get_secret_scanner().scan_buffer(mapped)
+    except (OSError, ValueError):
+        return []
+
+
+def _walk_tree(root: str, max_file_size: int) -> List[Tuple[str, int, int, int]]:
+    """List (path, size, mtime_ns, inode) for every regular file under root worth scanning"""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name not in SCAN_TREE_PRUNED_DIRS]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                continue
+            # Skip symlinks, special files and anything scan_file would reject
+            if not (stat.st_mode & 0o170000 == 0o100000) or not 0 < stat.st_size <= max_file_size:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime_ns, stat.st_ino))
+    return files
+
+
+def _shard_by_size(files: List[Tuple[str, int, int, int]], shard_count: int) -> List[List[str]]:
+    """Split files into shards of roughly equal total size, largest files first"""
+    import heapq
+
+    heap = [(0, shard) for shard in range(shard_count)]
+    shards = [[] for _ in range(shard_count)]
+    for path, size, _, _ in sorted(files, key=lambda item: item[1], reverse=True):
+        total, shard = heapq.heappop(heap)
+        shards[shard].append(path)
+        heapq.heappush(heap, (total + size, shard))
+    return [shard for shard in shards if shard]
+
+
+def _file_digest(path: str) -> Optional[str]:
+    """Hash a file's contents with blake2b without reading it into memory"""
+    import hashlib
+    import mmap
+
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hashlib.blake2b(b'', digest_size=16).hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return hashlib.blake2b(mapped, digest_size=16).hexdigest()
+    except (OSError, ValueError):
+        return None
+
+
+def _scan_shard(
+    paths: List[str],
+    max_file_size: int,
+    known_digests: Optional[Dict[str, str]] = None
+) -> List[Tuple[str, Optional[str], Optional[List[Dict[str, Any]]]]]:
+    """
+    Scan a shard of files in a worker process
+
+    With known_digests (used by the scan cache), each file is hashed first and
+    files whose content hash is unchanged are not rescanned.
+
+    Returns:
+        List of (path, digest, findings); findings is None when the digest matched
+    """
+    results = []
+    for path in paths:
+        digest = None
+        if known_digests is not None:
+            digest = _file_digest(path)
+            if digest is not None and known_digests.get(path) == digest:
+                results.append((path, digest, None))
+                continue
+        results.append((path, digest, scan_file(path, max_file_size=max_file_size)))
+    return results
+
+
+def _rules_digest(patterns: List[str]) -> str:
+    """Hash the compiled secret rules so cached results expire when they change"""
+    import hashlib
+
+    rules = json.dumps([
+        [pattern, re.compile(pattern, re.MULTILINE).flags] for pattern in patterns
+    ] + [SCAN_CACHE_VERSION])
+    return hashlib.blake2b(rules.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ScanCache:
+    """
+    On-disk cache of per-file scan results for scan_tree
+
+    Entries are keyed by path relative to the scanned root and validated by
+    (size, mtime_ns, inode). When that fingerprint changed, the stored content
+    hash lets an untouched file skip the regex scan. The whole cache is dropped
+    when SECRET_PATTERNS change. Files modified within a second of being scanned
+    are always re-verified by hash, since their mtime may not reflect a later write.
+    """
+
+    def __init__(self, db_path: Union[str, Path], patterns: Optional[List[str]] = None):
+        import sqlite3
+
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.db_path))
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                digest TEXT,
+                scanned_ns INTEGER NOT NULL,
+                findings TEXT NOT NULL
+            );
+        ''')
+
+        rules = _rules_digest(SECRET_PATTERNS if patterns is None else patterns)
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'rules'").fetchone()
+        if row is None or row[0] != rules:
+            with self._db:
+                self._db.execute('DELETE FROM files')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('rules', ?)", (rules,))
+
+        self._entries = {
+            path: (size, mtime_ns, inode, digest, scanned_ns, findings)
+            for path, size, mtime_ns, inode, digest, scanned_ns, findings
+            in self._db.execute('SELECT * FROM files')
+        }
+        self._updates = []
+
+    def lookup(self, path: str, size: int, mtime_ns: int, inode: int) -> Optional[List[Dict[str, Any]]]:
+        """Get cached findings if the file fingerprint is unchanged and trustworthy"""
+        entry = self._entries.get(path)
+        if entry is None or entry[:3] != (size, mtime_ns, inode):
+            return None
+        if mtime_ns >= entry[4] - 1_000_000_000:
+            return None  # Racily clean: written too close to the scan to trust mtime
+        return json.loads(entry[5])
+
+    def digest(self, path: str) -> Optional[str]:
+        """Get the content hash recorded for a path, if any"""
+        entry = self._entries.get(path)
+        return entry[3] if entry else None
+
+    def cached_findings(self, path: str) -> List[Dict[str, Any]]:
+        """Get the stored findings for a path regardless of its fingerprint"""
+        return json.loads(self._entries[path][5])
+
+    def store(
+        self,
+        path: str,
+        size: int,
+        mtime_ns: int,
+        inode: int,
+        digest: Optional[str],
+        findings: List[Dict[str, Any]]
+    ) -> None:
+        """Queue a scan result to be written on commit()"""
+        import time
+
+        self._updates.append((path, size, mtime_ns, inode, digest, time.time_ns(), json.dumps(findings)))
+
+    def commit(self, seen_paths: Optional[set] = None) -> None:
+        """Write queued results and forget paths that no longer exist"""
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', self._updates)
+            if seen_paths is not None:
+                removed = [(path,) for path in self._entries if path not in seen_paths]
+                self._db.executemany('DELETE FROM files WHERE path = ?', removed)
+        self._updates = []
+
+    def close(self) -> None:
+        """Close the underlying database"""
+        self._db.close()
+
+
+def scan_tree(
+    root: Union[str, Path],
+    workers: Optional[int] = None,
+    max_file_size: Optional[int] = None,
+    cache_path: Optional[Union[str, Path]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Detect secrets in every file of a working tree using a process pool
+
+    The tree is walked once, skipping SCAN_TREE_PRUNED_DIRS, and the files are
+    split into size-balanced shards that workers scan with scan_file. Findings
+    are yielded as each shard completes, so output order is not deterministic.
+    With cache_path, results are kept in a ScanCache and unchanged files are
+    answered from it without being read.
+
+    Args:
+        root: Directory to scan
+        workers: Number of worker processes, defaults to the CPU count
+        max_file_size: Size limit in bytes, defaults to create_secure_config()
+        cache_path: Optional ScanCache database, e.g. default_scan_cache_path(root)
+
+    Yields:
+        Detected secrets with a 'path' key relative to root
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    root = str(root)
+    workers = workers or os.cpu_count() or 1
+    if max_file_size is None:
+        max_file_size = create_secure_config()['max_file_size']
+
+    files = _walk_tree(root, max_file_size)
+    cache = ScanCache(cache_path) if cache_path is not None else None
+    fingerprints = {}
+    known_digests = None
+    pending = files
+
+    try:
+        if cache is not None:
+            known_digests = {}
+            pending = []
+            for entry in files:
+                relative = os.path.relpath(entry[0], root)
+                fingerprints[entry[0]] = (relative,) + entry[1:]
+                cached = cache.lookup(relative, *entry[1:])
+                if cached is None:
+                    pending.append(entry)
+                    digest = cache.digest(relative)
+                    if digest is not None:
+                        known_digests[entry[0]] = digest
+                    continue
+                for finding in cached:
+                    finding['path'] = relative
+                    yield finding
+
+        def finish(results):
+            for path, digest, findings in results:
+                relative = os.path.relpath(path, root)
+                if cache is not None:
+                    if findings is None:
+                        findings = cache.cached_findings(relative)
+                    cache.store(*fingerprints[path], digest, findings)
+                for finding in findings:
+                    finding['path'] = relative
+                    yield finding
+
+        if workers == 1 or len(pending) < 2:
+            yield from finish(_scan_shard([entry[0] for entry in pending], max_file_size, known_digests))
+        else:
+            # Several shards per worker keep all cores busy when file sizes are skewed
+            shards = _shard_by_size(pending, workers * 4)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(
+                        _scan_shard, shard, max_file_size,
+                        None if known_digests is None else {path: known_digests[path] for path in shard if path in known_digests}
+                    )
+                    for shard in shards
+                ]
+                for future in as_completed(futures):
+                    yield from finish(future.result())
+
+        if cache is not None:
+            cache.commit({fingerprint[0] for fingerprint in fingerprints.values()})
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def default_scan_cache_path(root: Union[str, Path]) -> Path:
+    """Get the default ScanCache location for a working tree"""
+    return Path(root) / '.claude' / 'secret_scan_cache.sqlite'
+
+
+def _scan_added_lines(path: str, first_line: int, lines: List[str]) -> List[Dict[str, Any]]:
+    """Detect secrets in a block of consecutive added lines and locate them by line"""
+    import bisect
+
+    offsets = []
+    position = 0
+    for line in lines:
+        offsets.append(position)
+        position += len(line) + 1
+
+    findings = []
+    for finding in detect_secrets('\n'.join(lines)):
+        index = bisect.bisect_right(offsets, finding['start']) - 1
+        finding['path'] = path
+        finding['line'] = first_line + index
+        finding['start'] -= offsets[index]
+        finding['end'] -= offsets[index]
+        findings.append(finding)
+    return findings
+
+
+def scan_staged(repo: Optional[Union[str, Path]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Detect secrets in the lines added by the staged changes of a git repository
+
+    The output of 'git diff --cached -U0' is read as a stream and only the
+    added lines of each hunk are scanned, so the cost follows the size of the
+    diff rather than the size of the repository. Hunks are consumed by the
+    line counts in their '@@' headers, so content lines that look like
+    headers ('+++ ...' for an added '++ ...') are still read as content.
+
+    Args:
+        repo: Repository directory, defaults to the current directory
+
+    Yields:
+        Detected secrets with 'path', 'line' (1-based, in the staged file) and
+        'start'/'end' as column offsets within that line
+
+    Raises:
+        RuntimeError: If git diff fails
+    """
+    import codecs
+    import subprocess
+
+    process = subprocess.Popen(
+        ['git', '-c', 'core.quotePath=false', 'diff', '--cached', '-U0',
+         '--no-color', '--no-ext-diff', '--diff-filter=d'],
+        cwd=None if repo is None else str(repo),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding='utf-8',
+        errors='replace'
+    )
+
+    path = None
+    first_line = 0
+    added = []
+    old_left = new_left = 0   # Lines of the current hunk still to come
+    after_old_header = False  # Previous line was the '--- ' file header
+
+    try:
+        for raw_line in process.stdout:
+            line = raw_line.rstrip('\n')
+
+            if old_left > 0 or new_left > 0:
+                # Inside a hunk every line is content, whatever it looks like
+                marker = line[:1]
+                if marker == '+':
+                    new_left -= 1
+                    if path is not None:
+                        added.append(line[1:])
+                    continue
+                if marker == '-':
+                    old_left -= 1
+                elif marker == ' ':
+                    old_left -= 1
+                    new_left -= 1
+                # '\ No newline at end of file' counts toward neither side
+
+            # Any other line ends the current block of added lines
+            if added:
+                yield from _scan_added_lines(path, first_line, added)
+                added = []
+
+            if old_left > 0 or new_left > 0:
+                continue
+
+            if line.startswith('+++ ') and after_old_header:
+                target = line[4:]
+                if target.endswith('\t'):
+                    target = target[:-1]  # Git marks names containing spaces with a tab
+                if target.startswith('"') and target.endswith('"'):
+                    target = codecs.escape_decode(target[1:-1])[0].decode('utf-8', errors='replace')
+                path = target[2:] if target.startswith('b/') else None
+            elif line.startswith('diff --git '):
+                path = None
+            elif line.startswith('@@ '):
+                match = re.match(r'@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@', line)
+                if match:
+                    old_left = int(match.group(1)) if match.group(1) is not None else 1
+                    first_line = int(match.group(2))
+                    new_left = int(match.group(3)) if match.group(3) is not None else 1
+            after_old_header = line.startswith('--- ')
+
+        if added:
+            yield from _scan_added_lines(path, first_line, added)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"git diff --cached failed: {stderr.strip()}")
+
+
+def _classify_secret_type(pattern: str) -> str:
+    """Classify the type of secret based on the regex pattern"""
+    if 'api' in pattern.lower() or 'token' in pattern.lower():
+        return 'api_key'
+    elif 'password' in pattern.lower():
+        return 'password'
+    elif 'private key' in pattern.upper():
+        return 'private_key'
+    elif 'bearer' in pattern.lower():
+        return 'bearer_token'
+    elif 'aws' in pattern.lower():
+        return 'aws_credential'
+    elif 'jwt' in pattern.lower() or 'eyJ' in pattern:
+        return 'jwt_token'
+    else:
+        return 'unknown_secret'
+
+
+def is_dangerous_file_path(file_path: str) -> bool:
+    """
+    Check if a file path is potentially dangerous to access
+
+    Args:
+        file_path: File path to check
+
+    Returns:
+        True if the path is dangerous, False otherwise
+    """
+    path_str = str(file_path).lower()
+
+    for pattern in DANGEROUS_FILE_PATTERNS:
+        if re.search(pattern, path_str, re.IGNORECASE):
+            return True
+
+    return False
+
+
+# What validate_tool_input does when a ValidationBudget runs out
+VALIDATION_BUDGET_POLICIES = ('fail_open', 'fail_closed')
+
+# Characters of a large value scanned per detector call, between budget checks
+VALIDATION_CHUNK_SIZE = 256 * 1024
+
+
+class ValidationBudget:
+    """
+    CPU-time and size budget for scanning one tool input
+
+    Values up to chunk_size are scanned whole (and memoized by detect_secrets);
+    larger ones are scanned in chunks with an overlap, as iter_secrets_stream
+    does, stopping at the first finding. CPU time (time.thread_time) and the
+    number of characters scanned are checked between chunks, so one oversized
+    or pathological value costs at most about one chunk past the budget. When
+    the budget runs out, exceeded says which limit was hit and on_exceeded
+    decides whether validate_tool_input blocks the input or lets it through.
+    """
+
+    def __init__(
+        self,
+        max_chars: Optional[int] = None,
+        cpu_seconds: Optional[float] = None,
+        on_exceeded: Optional[str] = None,
+        chunk_size: int = VALIDATION_CHUNK_SIZE
+    ):
+        """
+        Args:
+            max_chars: Characters scanned across all values (default from create_secure_config())
+            cpu_seconds: CPU time spent scanning (default from create_secure_config())
+            on_exceeded: One of VALIDATION_BUDGET_POLICIES (default from create_secure_config())
+            chunk_size: Characters scanned per detector call
+
+        Raises:
+            ValueError: If the policy is unknown
+        """
+        defaults = create_secure_config()['validation_budget']
+        self.max_chars = defaults['max_chars'] if max_chars is None else max_chars
+        self.cpu_seconds = defaults['cpu_seconds'] if cpu_seconds is None else cpu_seconds
+        self.on_exceeded = defaults['on_exceeded'] if on_exceeded is None else on_exceeded
+        if self.on_exceeded not in VALIDATION_BUDGET_POLICIES:
+            raise ValueError(
+                f"Unknown budget policy: {self.on_exceeded!r} (expected one of {', '.join(VALIDATION_BUDGET_POLICIES)})"
+            )
+        self.chunk_size = chunk_size
+
+        self.chars_scanned = 0
+        self.exceeded: Optional[str] = None  # 'size' or 'cpu' once the budget has run out
+        self._started: Optional[float] = None
+
+    @property
+    def cpu_used(self) -> float:
+        """CPU seconds spent scanning so far"""
+        import time
+
+        return 0.0 if self._started is None else time.thread_time() - self._started
+
+    def first_secret(self, value: str) -> Optional[Dict[str, Any]]:
+        """
+        Scan a value within the remaining budget
+
+        Args:
+            value: String to scan
+
+        Returns:
+            The first secret found, or None (check exceeded to tell whether the
+            whole value was scanned)
+        """
+        import io
+        import time
+
+        if self.exceeded:
+            return None
+        if self._started is None:
+            self._started = time.thread_time()
+
+        remaining = self.max_chars - self.chars_scanned
+        text = value if len(value) <= remaining else value[:remaining]
+
+        if len(text) <= self.chunk_size:
+            self.chars_scanned += len(text)
+            findings = detect_secrets(text)
+            if findings:
+                return min(findings, key=lambda f: f['start'])
+        else:
+            segments = _iter_stream_segments(io.StringIO(text), self.chunk_size, STREAM_MAX_MATCH_LENGTH)
+            try:
+                for segment, _, findings in segments:
+                    self.chars_scanned += len(segment)
+                    if findings:
+                        return findings[0]
+                    if self.cpu_used > self.cpu_seconds:
+                        self.exceeded = 'cpu'
+                        return None
+            finally:
+                segments.close()
+
+        if len(text) < len(value):
+            self.exceeded = 'size'
+        elif self.cpu_used > self.cpu_seconds:
+            self.exceeded = 'cpu'
+        return None
+
+
+# Per-tool field plans for validate_tool_input: 'skip', 'path' (dangerous path
+# check), 'scan' (secret scan) or 'recurse' (scan every string inside); a dict
+# is the plan for each object of a nested list (or a nested object)
+VALIDATION_FIELD_ACTIONS = ('skip', 'path', 'scan', 'recurse')
+
+TOOL_FIELD_PLANS = {
+    'Bash': {'command': 'scan', 'description': 'skip', 'timeout': 'skip'},
+    'Read': {'file_path': 'path', 'limit': 'skip', 'offset': 'skip'},
+    'Write': {'file_path': 'path', 'content': 'scan'},
+    'Edit': {'file_path': 'path', 'old_string': 'scan', 'new_string': 'scan', 'replace_all': 'skip'},
+    'MultiEdit': {
+        'file_path': 'path',
+        'edits': {'old_string': 'scan', 'new_string': 'scan', 'replace_all': 'skip'},
+    },
+    'Grep': {
+        'pattern': 'skip', 'path': 'skip', 'glob': 'skip', 'type': 'skip', 'output_mode': 'skip',
+        '-i': 'skip', '-n': 'skip', '-A': 'skip', '-B': 'skip', '-C': 'skip',
+    },
+    'Glob': {'pattern': 'skip', 'path': 'skip'},
+    'LS': {'path': 'skip', 'ignore': 'skip'},
+}
+
+# Deepest nesting validate_tool_input follows before rejecting the input
+VALIDATION_MAX_DEPTH = 32
+
+# Joins the values of one tool input for a single scan. Some patterns
+# ([^:]+, [^@]+) can still match across it, so validate() checks that a
+# finding lies within one field
+_SCAN_FIELD_SEPARATOR = '\n\x00\n'
+
+
+class ToolValidator:
+    """
+    Compiled validation plan for one tool's input
+
+    Built once per tool from TOOL_FIELD_PLANS. It checks the keys of the input
+    (and of nested objects) against the plan, path-checks 'path' fields, and
+    gathers every string to scan, including those inside nested values. The
+    strings are joined into one text and scanned in a single pass, so a
+    MultiEdit with many edits costs one detector call rather than one per
+    string. A match that spans two fields is not a finding; when one comes
+    first, the fields are rescanned one at a time. Tools without a plan
+    accept any key: 'file_path' is path-checked and every other value is
+    scanned, nested values included.
+    """
+
+    def __init__(self, name: str, plan: Optional[Dict[str, Any]], nested: bool = False):
+        """
+        Args:
+            name: Tool name (or 'Tool.field' for a nested plan), used in error messages
+            plan: Field plan, or None for tools without one
+            nested: True for the plan of a nested object
+
+        Raises:
+            ValueError: If the plan uses an unknown action
+        """
+        self.name = name
+        actions = {} if nested else {'tool_name': 'skip', 'raw_input': 'scan'}
+        if plan is None:
+            actions['file_path'] = 'path'
+        else:
+            actions.update(plan)
+        self.allowed = frozenset(actions) if plan is not None else None
+        self.default = 'skip' if plan is not None else 'recurse'
+
+        self._actions: Dict[str, str] = {}
+        self._nested: Dict[str, 'ToolValidator'] = {}
+        for field, action in actions.items():
+            if isinstance(action, dict):
+                self._nested[field] = ToolValidator(f'{name}.{field}', action, nested=True)
+                action = 'recurse'
+            elif action not in VALIDATION_FIELD_ACTIONS:
+                raise ValueError(f"Unknown action for {name}.{field}: {action!r}")
+            self._actions[field] = action
+
+    def validate(self, tool_input: Dict[str, Any], budget: ValidationBudget) -> None:
+        """
+        Validate one tool input against the plan
+
+        Args:
+            tool_input: Input dictionary
+            budget: Budget for the secret scan
+
+        Raises:
+            ValueError: On unexpected keys, a dangerous path, a secret, too
+                deep nesting, or a fail-closed budget running out
+        """
+        import bisect
+
+        texts: List[Tuple[str, str]] = []
+        paths: List[str] = []
+        self._collect(tool_input, '', texts, paths, 0)
+
+        for file_path in paths:
+            if is_dangerous_file_path(file_path):
+                raise ValueError(f"Access to dangerous file path blocked: {file_path}")
+
+        if not texts:
+            return
+
+        labels = [label for label, _ in texts]
+        starts = []
+        position = 0
+        for _, text in texts:
+            starts.append(position)
+            position += len(text) + len(_SCAN_FIELD_SEPARATOR)
+        combined = texts[0][1] if len(texts) == 1 else _SCAN_FIELD_SEPARATOR.join(text for _, text in texts)
+
+        charged = budget.chars_scanned
+        secret = budget.first_secret(combined)
+        label = None
+        if secret:
+            index = bisect.bisect_right(starts, secret['start']) - 1
+            if secret['end'] <= starts[index] + len(texts[index][1]):
+                raise ValueError(f"Potential secret detected in {labels[index]}: {secret['type']}")
+
+            # Any match within a single field would also have matched the combined text.
+            # The rescan covers every field, so its characters are charged once, not twice
+            budget.chars_scanned = charged
+            for label, text in texts:
+                secret = budget.first_secret(text)
+                if secret:
+                    raise ValueError(f"Potential secret detected in {label}: {secret['type']}")
+                if budget.exceeded:
+                    break
+        elif budget.exceeded:
+            label = labels[bisect.bisect_right(starts, max(budget.chars_scanned - 1, 0)) - 1]
+
+        if budget.exceeded and budget.on_exceeded == 'fail_closed':
+            raise ValueError(f"Validation budget exceeded ({budget.exceeded}) while scanning {label}")
+
+    def _collect(
+        self,
+        values: Dict[str, Any],
+        prefix: str,
+        texts: List[Tuple[str, str]],
+        paths: List[str],
+        depth: int
+    ) -> None:
+        if self.allowed is not None:
+            invalid_keys = set(values) - self.allowed
+            if invalid_keys:
+                raise ValueError(f"Invalid keys for {self.name}: {invalid_keys}")
+
+        for key, value in values.items():
+            action = self._actions.get(key, self.default)
+            if action == 'skip':
+                continue
+            if action == 'path':
+                if isinstance(value, str):
+                    paths.append(value)
+            elif action == 'scan':
+                if isinstance(value, str):
+                    texts.append((f'{prefix}{key}', value))
+            else:
+                _collect_nested(value, f'{prefix}{key}', self._nested.get(key), texts, paths, depth + 1)
+
+
+def _collect_nested(
+    value: Any,
+    label: str,
+    validator: Optional[ToolValidator],
+    texts: List[Tuple[str, str]],
+    paths: List[str],
+    depth: int
+) -> None:
+    if depth > VALIDATION_MAX_DEPTH:
+        raise ValueError(f"Tool input nested too deeply at {label}")
+
+    if isinstance(value, str):
+        texts.append((label, value))
+    elif isinstance(value, (list, tuple)):
+        for index, item in enumerate(value):
+            _collect_nested(item, f'{label}[{index}]', validator, texts, paths, depth + 1)
+    elif isinstance(value, dict):
+        if validator is not None:
+            validator._collect(value, f'{label}.', texts, paths, depth)
+        else:
+            for key, item in value.items():
+                _collect_nested(item, f'{label}.{key}', None, texts, paths, depth + 1)
+
+
+def _redact_nested(value: Any, depth: int = 0) -> Any:
+    # The walk of _collect_nested, rebuilding the value with secret strings
+    # redacted; anything nested deeper than it follows is redacted whole
+    if depth > VALIDATION_MAX_DEPTH:
+        return '[REDACTED_FOR_SECURITY]'
+
+    if isinstance(value, str):
+        return '[REDACTED_FOR_SECURITY]' if detect_secrets(value) else value
+    if isinstance(value, (list, tuple)):
+        return [_redact_nested(item, depth + 1) for item in value]
+    if isinstance(value, dict):
+        return {key: _redact_nested(item, depth + 1) for key, item in value.items()}
+    return value
+
+
+_tool_validators: Dict[str, ToolValidator] = {}
+
+
+def get_tool_validator(tool_name: Any) -> ToolValidator:
+    """
+    Get the compiled ToolValidator for a tool, built on first use
+
+    Args:
+        tool_name: Tool name from the input ('unknown' and other tools without a plan share one)
+
+    Returns:
+        ToolValidator for TOOL_FIELD_PLANS[tool_name], or the planless validator
+    """
+    if not isinstance(tool_name, str) or tool_name not in TOOL_FIELD_PLANS:
+        tool_name = ''
+    validator = _tool_validators.get(tool_name)
+    if validator is None:
+        plan = TOOL_FIELD_PLANS.get(tool_name)
+        validator = _tool_validators[tool_name] = ToolValidator(tool_name or 'unknown', plan)
+    return validator
+
+
+def validate_tool_input(tool_input: Any, budget: Optional[ValidationBudget] = None) -> Dict[str, Any]:
+    """
+    Validate and sanitize tool input
+
+    Fields are checked by the tool's ToolValidator (see TOOL_FIELD_PLANS), and
+    the strings it selects are scanned for secrets within a ValidationBudget.
+    If the budget runs out, a 'fail_closed' budget blocks the input and a
+    'fail_open' one stops scanning and lets it through (budget.exceeded
+    records why).
+
+    Args:
+        tool_input: Raw tool input to validate
+        budget: Scanning budget (default: ValidationBudget() from create_secure_config())
+
+    Returns:
+        Validated tool input dictionary
+
+    Raises:
+        ValueError: If input is invalid or dangerous, or a fail-closed budget runs out
+    """
+    if not isinstance(tool_input, dict):
+        # Convert string inputs to dict format
+        if isinstance(tool_input, str):
+            try:
+                parsed = json.loads(tool_input)
+                if isinstance(parsed, dict):
+                    tool_input = parsed
+                else:
+                    tool_input = {'raw_input': tool_input}
+            except json.JSONDecodeError:
+                tool_input = {'raw_input': tool_input}
+        else:
+            tool_input = {'raw_input': str(tool_input)}
+
+    # Get tool name from input or environment
+    tool_name = tool_input.get('tool_name', 'unknown')
+
+    get_tool_validator(tool_name).validate(tool_input, budget or ValidationBudget())
+
+    return tool_input
+
+
+def sanitize_output(output: str, max_length: int = 10000) -> str:
+    """
+    Sanitize output by removing potential secrets and limiting length
+
+    Args:
+        output: Raw output to sanitize
+        max_length: Maximum length of output
+
+    Returns:
+        Sanitized output string
+    """
+    if not isinstance(output, str):
+        output = str(output)
+
+    # Truncate if too long
+    if len(output) > max_length:
+        output = output[:max_length] + '\n... [TRUNCATED FOR SECURITY]'
+
+    # Replace potential secrets with placeholders
+    return redact_secrets(output)
+
+
+# Content-addressed storage for logged tool inputs
+BLOB_DIGEST_SIZE = 32
+
+# Sanitized inputs larger than this (serialized bytes) go to the blob store
+BLOB_INLINE_LIMIT = 1024
+
+_BLOB_DIGEST = re.compile(r'^[0-9a-f]{%d}$' % (BLOB_DIGEST_SIZE * 2))
+
+
+def input_digest(data: bytes) -> str:
+    """
+    Stable content digest used for input_hash and blob keys
+
+    Args:
+        data: Serialized content
+
+    Returns:
+        Hex blake2b digest (BLOB_DIGEST_SIZE bytes), the same in every process
+    """
+    import hashlib
+
+    return hashlib.blake2b(data, digest_size=BLOB_DIGEST_SIZE).hexdigest()
+
+
+def _canonical_json(value: Any) -> bytes:
+    # One serialization per value (sorted keys, no whitespace) so equal inputs share a digest
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+
+
+class BlobStore:
+    """
+    Content-addressed store of logged tool inputs
+
+    Each blob is a file named by the input_digest() of its content, fanned out
+    by the first two hex digits ('ab/abcdef...'), so identical payloads are
+    stored once however often they are logged. Blobs are written to a
+    temporary file and renamed into place, which makes concurrent writers of
+    the same content harmless.
+    """
+
+    def __init__(self, root: Union[str, Path]):
+        """
+        Args:
+            root: Directory holding the blobs (created with mode 0700)
+        """
+        self.root = Path(root)
+        self._known = set()  # Digests this process has already stored or seen on disk
+
+    def path_for(self, digest: str) -> Path:
+        """
+        Location of a blob
+
+        Raises:
+            ValueError: If digest is not a hex digest of the expected size
+        """
+        if not _BLOB_DIGEST.match(digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return self.root / digest[:2] / digest
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._known or self.path_for(digest).exists()
+
+    def put(self, data: bytes, digest: Optional[str] = None) -> str:
+        """
+        Store content unless a blob with the same digest exists
+
+        Args:
+            data: Content to store
+            digest: input_digest(data), if already computed
+
+        Returns:
+            The blob's digest
+        """
+        import tempfile
+
+        digest = digest or input_digest(data)
+        if digest in self._known:
+            return digest
+
+        path = self.path_for(digest)
+        if not path.exists():
+            path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            fd, temporary = tempfile.mkstemp(dir=path.parent, prefix='.blob-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temporary, path)
+            except BaseException:
+                try:
+                    os.unlink(temporary)
+                except OSError:
+                    pass
+                raise
+
+        self._known.add(digest)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        """
+        Read a blob
+
+        Raises:
+            ValueError: If digest is malformed
+            KeyError: If no blob has this digest
+        """
+        try:
+            return self.path_for(digest).read_bytes()
+        except FileNotFoundError:
+            raise KeyError(digest) from None
+
+
+def default_blob_store_path() -> Path:
+    """Default location of the shared BlobStore"""
+    return Path.home() / '.claude' / 'blobs'
+
+
+_blob_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    """Get the shared BlobStore for default_blob_store_path()"""
+    global _blob_store
+
+    if _blob_store is None:
+        _blob_store = BlobStore(default_blob_store_path())
+
+    return _blob_store
+
+
+def create_security_log_entry(
+    tool_name: str,
+    tool_input: Any,
+    action: str,
+    details: Optional[Dict[str, Any]] = None,
+    blob_store: Optional[BlobStore] = None
+) -> Dict[str, Any]:
+    """
+    Create a standardized security log entry
+
+    Every string in the input, however deeply nested, is replaced by
+    '[REDACTED_FOR_SECURITY]' if it holds a secret. input_hash is the
+    input_digest() of the sanitized input, so the same input
+    gets the same hash in every process. With a blob_store, sanitized inputs
+    larger than BLOB_INLINE_LIMIT are stored there and the entry carries
+    'tool_input_blob' (equal to input_hash) instead of 'tool_input'.
+
+    Args:
+        tool_name: Name of the tool being used
+        tool_input: Input provided to the tool
+        action: Action taken (e.g., 'blocked', 'allowed', 'sanitized')
+        details: Additional details about the security action
+        blob_store: Store for large inputs (default: always log inputs inline)
+
+    Returns:
+        Security log entry dictionary
+    """
+    from datetime import datetime
+
+    log_entry = {
+        'timestamp': datetime.now().isoformat(),
+        'tool_name': tool_name,
+        'action': action,
+        'input_hash': None,
+    }
+
+    if details:
+        log_entry['details'] = details
+
+    # Sanitize the input before logging, nested values (such as MultiEdit edits) included
+    if isinstance(tool_input, dict):
+        log_entry['tool_input'] = _redact_nested(tool_input)
+    else:
+        log_entry['tool_input'] = '[REDACTED_FOR_SECURITY]' if detect_secrets(str(tool_input)) else str(tool_input)[:200]
+
+    if tool_input:
+        serialized = _canonical_json(log_entry['tool_input'])
+        log_entry['input_hash'] = input_digest(serialized)
+        if blob_store is not None and len(serialized) > BLOB_INLINE_LIMIT:
+            blob_store.put(serialized, log_entry['input_hash'])
+            del log_entry['tool_input']
+            log_entry['tool_input_blob'] = log_entry['input_hash']
+
+    return log_entry
+
+
+# Batched audit log writing
+AUDIT_FSYNC_POLICIES = ('none', 'batch', 'interval')
+
+
+class AuditLogWriter:
+    """
+    Batched, asynchronous JSONL writer for security log entries
+
+    write() serializes the entry and appends it to an in-memory buffer; a
+    background thread drains the buffer once batch_size entries are waiting or
+    flush_interval seconds have passed, and writes each batch with a single
+    write() call. Batches are written under a shared flock on '<log>.lock', so
+    rotate_log_file (which takes it exclusively) never splits a batch, and the
+    file is reopened when the log has been rotated away. When the buffer is
+    full, write() blocks until the thread catches up rather than dropping
+    entries, and close() writes everything accepted before it returns. With
+    max_bytes, the thread rotates the log into its LogArchive once a batch
+    leaves it larger than that.
+
+    fsync policies:
+        'none': leave durability to the OS
+        'batch': fsync after every batch
+        'interval': fsync at most once every fsync_interval seconds
+    """
+
+    def __init__(
+        self,
+        log_path: Union[str, Path],
+        batch_size: int = 1024,
+        flush_interval: float = 0.1,
+        fsync: str = 'batch',
+        fsync_interval: float = 1.0,
+        capacity: int = 65536,
+        max_bytes: Optional[int] = None
+    ):
+        """
+        Args:
+            log_path: JSONL file to append to (created with mode 0600)
+            batch_size: Write as soon as this many entries are buffered
+            flush_interval: Write buffered entries at least this often (seconds)
+            fsync: One of AUDIT_FSYNC_POLICIES
+            fsync_interval: Minimum seconds between fsyncs for the 'interval' policy
+            capacity: Maximum buffered entries before write() blocks
+            max_bytes: Rotate the log past this size (None to leave rotation to others)
+
+        Raises:
+            ValueError: If the fsync policy or a size is invalid
+        """
+        import atexit
+        import time
+        from collections import deque
+
+        if fsync not in AUDIT_FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync!r} (expected one of {', '.join(AUDIT_FSYNC_POLICIES)})")
+        if batch_size < 1 or capacity < batch_size:
+            raise ValueError('batch_size must be at least 1 and no larger than capacity')
+
+        self.log_path = Path(log_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._accepted = 0
+        self._persisted = 0
+        self._flush_requested = False
+        self._closed = False
+        self.error: Optional[OSError] = None
+
+        self._fd: Optional[int] = None
+        self._inode: Optional[Tuple[int, int]] = None
+        self._last_fsync = time.monotonic()
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(self.log_path.with_name(self.log_path.name + '.lock'), 'a')
+
+        self._thread = threading.Thread(target=self._run, name='AuditLogWriter', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        """
+        Queue one entry; blocks while the buffer is full
+
+        Raises:
+            ValueError: If the writer has been closed
+            TypeError: If the entry is not JSON serializable
+        """
+        line = json.dumps(entry) + '\n'
+
+        with self._cond:
+            if self._closed:
+                raise ValueError('AuditLogWriter is closed')
+            while len(self._buffer) >= self.capacity:
+                self._cond.wait()
+            self._buffer.append(line)
+            self._accepted += 1
+            if len(self._buffer) == self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every entry written so far has reached the log
+
+        Returns:
+            True if they did, False on timeout or while writes are failing
+        """
+        with self._cond:
+            target = self._accepted
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._persisted >= target or self.error is not None, timeout) \
+                and self._persisted >= target
+
+    def close(self) -> None:
+        """Write all buffered entries, stop the flush thread and close the log"""
+        import atexit
+
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        self._thread.join()
+        self._lock_file.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self) -> 'AuditLogWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        import time
+
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._flush_requested or len(self._buffer) >= self.batch_size,
+                    self.flush_interval
+                )
+                batch = list(self._buffer)
+                self._buffer.clear()
+                self._flush_requested = False
+                closing = self._closed
+                self._cond.notify_all()  # Unblock writers waiting for space
+
+            if batch:
+                try:
+                    self._write_batch(''.join(batch).encode('utf-8'))
+                except OSError as e:
+                    with self._cond:
+                        # Keep the batch (ahead of newer entries) and retry on the next cycle
+                        self.error = e
+                        self._buffer.extendleft(reversed(batch))
+                        self._cond.notify_all()
+                    if closing:
+                        break  # Nothing more can be done at shutdown
+                    time.sleep(self.flush_interval)
+                    continue
+
+                with self._cond:
+                    self.error = None
+                    self._persisted += len(batch)
+                    self._cond.notify_all()
+            elif self.fsync == 'interval' and self._fd is not None:
+                self._maybe_fsync(time.monotonic(), force=False)
+
+            if closing:
+                break
+
+        if self._fd is not None:
+            if self.fsync != 'none':
+                os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def _write_batch(self, data: bytes) -> None:
+        import fcntl
+        import time
+
+        fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+        try:
+            self._ensure_open()
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            if self.fsync == 'batch':
+                os.fsync(self._fd)
+            elif self.fsync == 'interval':
+                self._maybe_fsync(time.monotonic(), force=False)
+            oversized = self.max_bytes is not None and os.fstat(self._fd).st_size > self.max_bytes
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+        # rotate_log_file takes the lock exclusively, so only once it is released
+        if oversized:
+            rotate_log_file(str(self.log_path), max_entries=None, max_bytes=self.max_bytes,
+                            archive=get_log_archive(self.log_path))
+
+    def _maybe_fsync(self, now: float, force: bool) -> None:
+        if force or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._fd)
+            self._last_fsync = now
+
+    def _ensure_open(self) -> None:
+        # Reopen when the log was rotated (replaced) or removed since the last batch
+        try:
+            st = os.stat(self.log_path)
+            inode = (st.st_dev, st.st_ino)
+        except FileNotFoundError:
+            inode = None
+
+        if self._fd is not None and inode == self._inode:
+            return
+
+        if self._fd is not None:
+            if self.fsync != 'none':
+                os.fsync(self._fd)
+            os.close(self._fd)
+        self._fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        st = os.fstat(self._fd)
+        self._inode = (st.st_dev, st.st_ino)
+
+
+def default_audit_log_path() -> Path:
+    """Default location of the batched security audit log"""
+    return Path.home() / '.claude' / 'logs' / 'security_audit.jsonl'
+
+
+_audit_log_writer: Optional[AuditLogWriter] = None
+_audit_log_writer_lock = threading.Lock()
+
+
+def get_audit_log_writer() -> AuditLogWriter:
+    """Get the shared AuditLogWriter for default_audit_log_path(), rotated at LOG_ROTATION_MAX_BYTES"""
+    global _audit_log_writer
+    with _audit_log_writer_lock:
+        if _audit_log_writer is None:
+            _audit_log_writer = AuditLogWriter(default_audit_log_path(), max_bytes=LOG_ROTATION_MAX_BYTES)
+        return _audit_log_writer
+
+
+def log_security_event(
+    tool_name: str,
+    tool_input: Any,
+    action: str,
+    details: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Create a security log entry and queue it on the shared audit log writer
+
+    Large inputs go to the shared BlobStore and are referenced by digest.
+
+    Returns:
+        The entry that was queued
+    """
+    entry = create_security_log_entry(tool_name, tool_input, action, details, blob_store=get_blob_store())
+    get_audit_log_writer().write(entry)
+    return entry
+
+# Enhanced system directory protection
+SYSTEM_DIRECTORY_PATTERNS = [
+    r'^/etc/',           # System configuration
+    r'^/root/',          # Root home directory
+    r'^/var/log/',       # System logs
+    r'^/boot/',          # Boot files
+    r'^/sys/',           # System filesystem
+    r'^/proc/',          # Process filesystem
+    r'^/dev/',           # Device files
+    r'^/usr/bin/',       # System binaries
+    r'^/usr/sbin/',      # System admin binaries
+    r'^/lib/',           # System libraries
+    r'^/lib64/',         # 64-bit system libraries
+    r'\.dll$',           # Windows DLLs
+    r'\.exe$',           # Windows executables
+    r'\.scr$',           # Screen savers (potential malware)
+    r'\.msi$',           # Windows installers
+    r'\.bat$',           # Batch files (potential command injection)
+    r'\.cmd$',           # Command files
+    r'\.ps1$',           # PowerShell scripts
+]
+
+# Path components that are always sensitive, wherever they appear
+SENSITIVE_PATH_COMPONENTS = frozenset(['.env', '.git', '.ssh', '.aws', '.docker'])
+
+
+# Bounds for the realpath cache used by PathResolver
+RESOLVE_CACHE_MAX_ENTRIES = 4096
+RESOLVE_CACHE_REVALIDATE_SECONDS = 1.0
+
+
+class PathResolver:
+    """
+    Path.resolve() equivalent that caches the realpath of every path prefix
+
+    Paths are normalized lexically ('.', '//' and a trailing '/' are dropped), then
+    resolved one component at a time against a bounded LRU of resolved prefixes.
+    Each entry records its parent's resolved path and mtime. An entry younger than
+    RESOLVE_CACHE_REVALIDATE_SECONDS is trusted outright, so repeated checks under
+    the same tree cost no filesystem calls. Older entries are revalidated with one
+    stat of the parent, because adding, removing or retargeting a symlink changes
+    the mtime of the directory that holds it; symlink entries are re-resolved. A
+    change of working directory clears the cache. Paths containing '..' are
+    passed to Path.resolve() unchanged, since '..' after a symlink cannot be
+    collapsed lexically.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESOLVE_CACHE_MAX_ENTRIES,
+        revalidate_seconds: float = RESOLVE_CACHE_REVALIDATE_SECONDS
+    ):
+        from collections import OrderedDict
+
+        self.max_entries = max_entries
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = OrderedDict()  # path -> (realpath, parent realpath, parent mtime_ns, is symlink, checked at)
+        self._cwd = None
+        self._real_cwd = None
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._cwd = None
+        self._real_cwd = None
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def cwd(self) -> str:
+        """
+        Resolved working directory, clearing the cache when it has changed
+
+        Returns:
+            Realpath of os.getcwd()
+        """
+        cwd = os.getcwd()
+        if cwd != self._cwd:
+            self._entries.clear()
+            self._cwd = cwd
+            self._real_cwd = self._resolve_absolute(cwd)
+        return self._real_cwd
+
+    def resolve(self, file_path: str) -> str:
+        """
+        Resolve a path like str(Path(file_path).resolve())
+
+        Args:
+            file_path: Absolute or working-directory-relative path
+
+        Returns:
+            Absolute path with symlinks resolved
+
+        Raises:
+            OSError: If the working directory is unavailable
+            ValueError: If the path contains a NUL byte
+            RuntimeError: On a symlink loop, as Path.resolve() does
+        """
+        from pathlib import Path
+
+        file_path = str(file_path)
+        if '\x00' in file_path:
+            raise ValueError('embedded null byte')
+        if os.name != 'posix':
+            return str(Path(file_path).resolve())
+
+        self.cwd()  # Invalidate on cwd change
+        if not file_path.startswith('/'):
+            file_path = f'{self._cwd}/{file_path}'
+
+        parts = [part for part in file_path.split('/') if part and part != '.']
+        if '..' in parts:
+            return str(Path(file_path).resolve())
+
+        return self._resolve_absolute('/' + '/'.join(parts))
+
+    def _resolve_absolute(self, path: str) -> str:
+        """Resolve a lexically normalized absolute path through the prefix cache"""
+        import time
+
+        if path == '/':
+            return path
+
+        now = time.monotonic()
+        parent, _, name = path.rpartition('/')
+        parent = parent or '/'
+
+        entry = self._entries.get(path)
+        if entry is not None:
+            real, parent_real, stamp, is_link, checked_at = entry
+            if now - checked_at < self.revalidate_seconds:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return real
+            # A symlink's target can change anywhere on disk, so those are re-resolved
+            if (not is_link and self._resolve_absolute(parent) == parent_real
+                    and self._mtime(parent_real) == stamp):
+                self._entries[path] = (real, parent_real, stamp, is_link, now)
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return real
+            del self._entries[path]
+
+        self.misses += 1
+        parent_real = self._resolve_absolute(parent)
+        stamp = self._mtime(parent_real)
+        candidate = parent_real.rstrip('/') + '/' + name
+
+        try:
+            import stat
+            is_link = stat.S_ISLNK(os.lstat(candidate).st_mode)
+        except OSError:
+            is_link = False
+
+        if is_link:
+            from pathlib import Path
+            real = str(Path(candidate).resolve())
+        else:
+            real = candidate
+
+        self._entries[path] = (real, parent_real, stamp, is_link, now)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return real
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+
+_path_resolver = None
+
+
+def get_path_resolver() -> PathResolver:
+    """
+    Get the shared PathResolver
+
+    Returns:
+        PathResolver instance
+    """
+    global _path_resolver
+
+    if _path_resolver is None:
+        _path_resolver = PathResolver()
+
+    return _path_resolver
+
+
+def _classify_path_rule(pattern: str) -> Tuple[str, str]:
+    """
+    Classify a path regex as a prefix, suffix or substring rule over a plain literal
+
+    Args:
+        pattern: Regex pattern source
+
+    Returns:
+        (kind, literal) where kind is 'prefix', 'suffix', 'substring' or 'regex';
+        for 'regex' the literal is the original pattern
+    """
+    body = pattern
+    anchored_start = body.startswith('^')
+    anchored_end = body.endswith('$') and not body.endswith('\\$')
+    if anchored_start:
+        body = body[1:]
+    if anchored_end:
+        body = body[:-1]
+    if anchored_start and anchored_end:
+        return 'regex', pattern
+
+    literal = []
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char == '\\':
+            if i + 1 >= len(body) or body[i + 1].isalnum():
+                return 'regex', pattern  # \d, \b, ... are classes, not escapes
+            literal.append(body[i + 1])
+            i += 2
+            continue
+        if char in _REGEX_METACHARACTERS:
+            return 'regex', pattern
+        literal.append(char)
+        i += 1
+
+    literal = ''.join(literal).lower()
+    if not literal:
+        return 'regex', pattern
+    if anchored_start:
+        return 'prefix', literal
+    if anchored_end:
+        return 'suffix', literal
+    return 'substring', literal
+
+
+class PathPolicy:
+    """
+    Compiled form of the dangerous-path rules
+
+    Case-insensitive path regexes are split by shape: ^-anchored literals go into
+    a character trie, $-anchored literals into per-length hash sets, and every
+    other rule into one combined regex, so a path is checked in a single pass
+    instead of one re.search per rule.
+    """
+
+    def __init__(
+        self,
+        patterns: Optional[List[str]] = None,
+        sensitive_components: Optional[frozenset] = None,
+        confine_to_cwd: bool = True,
+        resolver: Optional[PathResolver] = None
+    ):
+        """
+        Args:
+            patterns: Case-insensitive path regexes (default: DANGEROUS_FILE_PATTERNS
+                plus SYSTEM_DIRECTORY_PATTERNS)
+            sensitive_components: Path components that are always dangerous
+            confine_to_cwd: Treat paths resolving outside the working directory as dangerous
+            resolver: PathResolver used to resolve symlinks (default: the shared resolver)
+        """
+        if patterns is None:
+            patterns = DANGEROUS_FILE_PATTERNS + SYSTEM_DIRECTORY_PATTERNS
+        if sensitive_components is None:
+            sensitive_components = SENSITIVE_PATH_COMPONENTS
+
+        self.sensitive_components = frozenset(sensitive_components)
+        self.confine_to_cwd = confine_to_cwd
+        self.resolver = resolver if resolver is not None else get_path_resolver()
+
+        self._prefix_trie = {}
+        self._suffixes = {}
+        searched = []
+
+        for pattern in patterns:
+            kind, literal = _classify_path_rule(pattern)
+            if kind == 'prefix':
+                node = self._prefix_trie
+                for char in literal:
+                    node = node.setdefault(char, {})
+                node[None] = True  # Terminal marker
+            elif kind == 'suffix':
+                self._suffixes.setdefault(len(literal), set()).add(literal)
+            elif kind == 'substring':
+                searched.append(re.escape(literal))
+            else:
+                searched.append(f'(?:{pattern})')
+
+        self._searched = re.compile('|'.join(searched), re.IGNORECASE) if searched else None
+
+    def _has_prefix(self, path: str) -> bool:
+        node = self._prefix_trie
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def matches(self, normalized_path: str) -> bool:
+        """
+        Check a normalized path against the compiled pattern rules only
+
+        Args:
+            normalized_path: Absolute, resolved path
+
+        Returns:
+            True if any prefix, suffix or substring rule matches
+        """
+        path_str = normalized_path.lower()
+
+        if self._prefix_trie and self._has_prefix(path_str):
+            return True
+
+        for length, suffixes in self._suffixes.items():
+            if path_str[-length:] in suffixes:
+                return True
+
+        return bool(self._searched and self._searched.search(path_str))
+
+    def _check(self, file_path: str, cwd_prefix: Optional[str]) -> bool:
+        from pathlib import Path
+
+        file_path = str(file_path)
+        if "../" in file_path or "..\\" in file_path:
+            return True
+
+        if not self.sensitive_components.isdisjoint(Path(file_path).parts):
+            return True
+
+        try:
+            normalized_path = self.resolver.resolve(file_path)
+        except (OSError, ValueError, RuntimeError):
+            return True
+
+        if self.matches(normalized_path):
+            return True
+
+        if cwd_prefix is not None:
+            if normalized_path != cwd_prefix[:-1] and not normalized_path.startswith(cwd_prefix):
+                return True
+
+        return False
+
+    def _cwd_prefix(self) -> Optional[str]:
+        """Resolved working directory with a trailing separator, or None when unconfined"""
+        if not self.confine_to_cwd:
+            return None
+        cwd = self.resolver.cwd()
+        return cwd if cwd.endswith(os.sep) else cwd + os.sep
+
+    def check(self, file_path: str) -> bool:
+        """
+        Check whether a single path is dangerous
+
+        Args:
+            file_path: File path to check
+
+        Returns:
+            True if the path is dangerous, False otherwise
+        """
+        try:
+            cwd_prefix = self._cwd_prefix()
+        except (OSError, ValueError, RuntimeError):
+            return True
+        return self._check(file_path, cwd_prefix)
+
+    def check_many(self, paths: List[str]) -> List[bool]:
+        """
+        Check a batch of paths (MultiEdit targets, glob results, a repo walk)
+
+        The working directory is resolved once for the whole batch.
+
+        Args:
+            paths: File paths to check
+
+        Returns:
+            One verdict per path, True where the path is dangerous
+        """
+        try:
+            cwd_prefix = self._cwd_prefix()
+        except (OSError, ValueError, RuntimeError):
+            return [True] * len(paths)
+        return [self._check(path, cwd_prefix) for path in paths]
+
+
+_path_policy = None
+
+
+def get_path_policy() -> PathPolicy:
+    """
+    Get the shared PathPolicy, compiled on first use
+
+    Returns:
+        PathPolicy instance for DANGEROUS_FILE_PATTERNS and SYSTEM_DIRECTORY_PATTERNS
+    """
+    global _path_policy
+
+    if _path_policy is None:
+        _path_policy = PathPolicy()
+
+    return _path_policy
+
+
+# Rate limiting algorithms supported by RateLimitTable
+RATE_LIMIT_ALGORITHMS = ('sliding_window', 'token_bucket')
+
+
+class _SlidingWindowRecord:
+    """Counts for the current and previous fixed window of one key"""
+
+    __slots__ = ('window', 'current', 'previous', 'expires')
+
+    def __init__(self, window: int, expires: float):
+        self.window = window
+        self.current = 0
+        self.previous = 0
+        self.expires = expires
+
+
+class _TokenBucketRecord:
+    """Remaining tokens of one key and when they were last refilled"""
+
+    __slots__ = ('tokens', 'updated', 'expires')
+
+    def __init__(self, tokens: float, updated: float, expires: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.expires = expires
+
+
+class RateLimitTable:
+    """
+    In-memory rate-limit state with O(1) work per check
+
+    'sliding_window' approximates a true sliding window from two fixed-window
+    counters: the previous window's count, weighted by how much of it still
+    overlaps the sliding window, plus the current window's count.
+    'token_bucket' holds max_requests tokens refilled evenly over window_seconds.
+
+    Each key is a fixed-size __slots__ record in an OrderedDict kept in
+    last-use order. A key whose state has fully decayed (two windows for the
+    counter, one for the bucket) is indistinguishable from a new key, so a
+    couple of expired records are dropped from the cold end on each check
+    instead of sweeping the whole table.
+    """
+
+    def __init__(self, algorithm: str = 'sliding_window'):
+        """
+        Args:
+            algorithm: One of RATE_LIMIT_ALGORITHMS
+
+        Raises:
+            ValueError: If the algorithm is unknown
+        """
+        from collections import OrderedDict
+
+        if algorithm not in RATE_LIMIT_ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+
+        self.algorithm = algorithm
+        self._records = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def acquire(
+        self,
+        identifier: str,
+        max_requests: int,
+        window_seconds: float,
+        cost: int = 1,
+        now: Optional[float] = None
+    ) -> bool:
+        """
+        Admit cost requests for identifier if the limit allows all of them
+
+        Args:
+            identifier: Key being limited
+            max_requests: Requests allowed per window
+            window_seconds: Window length in seconds
+            cost: Number of requests to admit at once
+            now: Current time.monotonic() value (for tests)
+
+        Returns:
+            True if admitted, False if rate limited (nothing is consumed)
+        """
+        import time
+
+        if now is None:
+            now = time.monotonic()
+
+        self._evict(now)
+
+        record = self._records.get(identifier)
+        if self.algorithm == 'sliding_window':
+            admitted, record = self._acquire_window(record, max_requests, window_seconds, cost, now)
+        else:
+            admitted, record = self._acquire_bucket(record, max_requests, window_seconds, cost, now)
+
+        self._records[identifier] = record
+        self._records.move_to_end(identifier)
+        return admitted
+
+    def retry_after(
+        self,
+        identifier: str,
+        max_requests: int,
+        window_seconds: float,
+        cost: int = 1,
+        now: Optional[float] = None
+    ) -> float:
+        """
+        Seconds until acquire() with the same arguments would be admitted
+
+        Args:
+            identifier: Key being limited
+            max_requests: Requests allowed per window
+            window_seconds: Window length in seconds
+            cost: Number of requests to admit at once
+            now: Current time.monotonic() value (for tests)
+
+        Returns:
+            0.0 if admissible now, float('inf') if cost exceeds max_requests
+        """
+        import time
+
+        if cost > max_requests:
+            return float('inf')
+        if now is None:
+            now = time.monotonic()
+
+        record = self._records.get(identifier)
+        if record is None:
+            return 0.0
+
+        if self.algorithm == 'token_bucket':
+            refill = max(0.0, now - record.updated) * max_requests / window_seconds
+            tokens = min(float(max_requests), record.tokens + refill)
+            return max(0.0, (cost - tokens) * window_seconds / max_requests)
+
+        window = int(now // window_seconds)
+        if record.window == window:
+            previous, current = record.previous, record.current
+        elif window - record.window == 1:
+            previous, current = record.current, 0
+        else:
+            return 0.0
+
+        def opens_at(previous, current, window):
+            # Earliest time in the window at which the weighted count leaves room for cost
+            if current + cost > max_requests:
+                return None
+            if previous == 0:
+                return window * window_seconds
+            overlap = (max_requests - current - cost) / previous
+            return (window + 1 - min(overlap, 1.0)) * window_seconds
+
+        at = opens_at(previous, current, window)
+        if at is None:
+            at = opens_at(current, 0, window + 1)
+        return max(0.0, at - now)
+
+    def _acquire_window(self, record, max_requests, window_seconds, cost, now):
+        window = int(now // window_seconds)
+        expires = (window + 2) * window_seconds
+
+        if record is None:
+            record = _SlidingWindowRecord(window, expires)
+        elif record.window != window:
+            record.previous = record.current if window - record.window == 1 else 0
+            record.current = 0
+            record.window = window
+
+        overlap = 1.0 - (now / window_seconds - window)
+        if record.previous * overlap + record.current + cost > max_requests:
+            return False, record
+
+        record.current += cost
+        record.expires = expires
+        return True, record
+
+    def _acquire_bucket(self, record, max_requests, window_seconds, cost, now):
+        if record is None:
+            record = _TokenBucketRecord(float(max_requests), now, now)
+        else:
+            refill = max(0.0, now - record.updated) * max_requests / window_seconds
+            record.tokens = min(float(max_requests), record.tokens + refill)
+            record.updated = now
+
+        if record.tokens < cost:
+            return False, record
+
+        record.tokens -= cost
+        # Time until the bucket is full again, after which the record is redundant
+        record.expires = now + (max_requests - record.tokens) * window_seconds / max_requests
+        return True, record
+
+    def _evict(self, now: float, limit: int = 2) -> None:
+        """Drop up to limit expired records from the least recently used end"""
+        records = self._records
+        for _ in range(limit):
+            if not records:
+                return
+            identifier = next(iter(records))
+            if records[identifier].expires > now:
+                return
+            del records[identifier]
+
+
+class SharedRateLimitTable(RateLimitTable):
+    """
+    RateLimitTable whose records live in a SQLite file shared by every process
+
+    Every hook runs as a fresh process, so in-memory state never sees a second
+    request. Here each check is one BEGIN IMMEDIATE transaction (read the
+    record, apply the same algorithm as RateLimitTable, write it back, evict up
+    to two expired rows), which serializes concurrent hook processes on the
+    database write lock. The database runs in WAL mode with synchronous=NORMAL:
+    losing the last few counter updates on power failure is acceptable, and an
+    fsync per check is not. Time is wall-clock (time.time()) so records stay
+    meaningful across processes and reboots.
+    """
+
+    _COLUMNS = {
+        'sliding_window': ('window', 'current', 'previous'),
+        'token_bucket': ('tokens', 'updated'),
+    }
+
+    def __init__(
+        self,
+        db_path: Union[str, Path],
+        algorithm: str = 'sliding_window',
+        timeout: float = 1.0
+    ):
+        """
+        Args:
+            db_path: SQLite file shared by all processes
+            algorithm: One of RATE_LIMIT_ALGORITHMS
+            timeout: Seconds to wait for the write lock before raising
+
+        Raises:
+            ValueError: If the algorithm is unknown
+            sqlite3.Error: If the database cannot be opened
+        """
+        import sqlite3
+
+        super().__init__(algorithm)
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            str(self.db_path), timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._lock = threading.Lock()  # One transaction at a time on this connection
+
+        table = algorithm  # Validated against RATE_LIMIT_ALGORITHMS above
+        columns = self._COLUMNS[algorithm]
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (identifier TEXT PRIMARY KEY, "
+            f"{', '.join(f'{column} REAL NOT NULL' for column in columns)}, expires REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires)")
+
+        self._select = f"SELECT {', '.join(columns)}, expires FROM {table} WHERE identifier = ?"
+        self._upsert = f"INSERT OR REPLACE INTO {table} VALUES (?, {', '.join('?' for _ in columns)}, ?)"
+        self._evict_sql = (
+            f"DELETE FROM {table} WHERE identifier IN "
+            f"(SELECT identifier FROM {table} WHERE expires <= ? LIMIT 2)"
+        )
+
+    def __len__(self) -> int:
+        return self._db.execute(f"SELECT COUNT(*) FROM {self.algorithm}").fetchone()[0]
+
+    def acquire(
+        self,
+        identifier: str,
+        max_requests: int,
+        window_seconds: float,
+        cost: int = 1,
+        now: Optional[float] = None
+    ) -> bool:
+        """
+        Admit cost requests for identifier if the shared limit allows all of them
+
+        Args:
+            identifier: Key being limited
+            max_requests: Requests allowed per window
+            window_seconds: Window length in seconds
+            cost: Number of requests to admit at once
+            now: Current time.time() value (for tests)
+
+        Returns:
+            True if admitted, False if rate limited (nothing is consumed)
+
+        Raises:
+            sqlite3.OperationalError: If the write lock is not obtained within the timeout
+        """
+        import time
+
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            return self._acquire_locked(identifier, max_requests, window_seconds, cost, now)
+
+    def _acquire_locked(self, identifier, max_requests, window_seconds, cost, now):
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._db.execute(self._select, (identifier,)).fetchone()
+
+            if self.algorithm == 'sliding_window':
+                record = None
+                if row is not None:
+                    record = _SlidingWindowRecord(int(row[0]), row[3])
+                    record.current, record.previous = row[1], row[2]
+                admitted, record = self._acquire_window(record, max_requests, window_seconds, cost, now)
+                values = (identifier, record.window, record.current, record.previous, record.expires)
+            else:
+                record = None if row is None else _TokenBucketRecord(row[0], row[1], row[2])
+                admitted, record = self._acquire_bucket(record, max_requests, window_seconds, cost, now)
+                values = (identifier, record.tokens, record.updated, record.expires)
+
+            self._db.execute(self._upsert, values)
+            self._db.execute(self._evict_sql, (now,))
+            self._db.execute('COMMIT')
+        except BaseException:
+            if self._db.in_transaction:
+                self._db.execute('ROLLBACK')
+            raise
+
+        return admitted
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def default_rate_limit_path() -> Path:
+    """Get the default SharedRateLimitTable location, shared by all hook processes ($CLAUDE_RATE_LIMIT_DB overrides it)"""
+    override = os.environ.get('CLAUDE_RATE_LIMIT_DB')
+    if override:
+        return Path(override).expanduser()
+    return Path.home() / '.claude' / 'rate_limits.sqlite'
+
+
+class RateLimiter:
+    """
+    Thread-safe, asyncio-aware rate limiter for one request policy
+
+    Keys are spread over lock stripes, each a RateLimitTable guarded by its own
+    threading.Lock, so threads checking different identifiers rarely contend
+    and two threads on the same identifier can never both take the last slot.
+    """
+
+    def __init__(
+        self,
+        max_requests: int,
+        window_seconds: float,
+        algorithm: str = 'sliding_window',
+        stripes: int = 16
+    ):
+        """
+        Args:
+            max_requests: Requests allowed per window for each identifier
+            window_seconds: Window length in seconds
+            algorithm: One of RATE_LIMIT_ALGORITHMS
+            stripes: Number of independently locked partitions
+        """
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.algorithm = algorithm
+        self._stripes = [(threading.Lock(), RateLimitTable(algorithm)) for _ in range(stripes)]
+
+    def _stripe(self, identifier: str):
+        return self._stripes[hash(identifier) % len(self._stripes)]
+
+    def try_acquire(self, identifier: str, n: int = 1) -> bool:
+        """
+        Reserve n requests at once, all or nothing
+
+        Args:
+            identifier: Key being limited
+            n: Number of requests to reserve
+
+        Returns:
+            True if all n were admitted, False if none were
+        """
+        lock, table = self._stripe(identifier)
+        with lock:
+            return table.acquire(identifier, self.max_requests, self.window_seconds, n)
+
+    def _acquire_or_wait(self, identifier: str, n: int) -> float:
+        """Admit n requests and return 0.0, or return the seconds until they would fit"""
+        lock, table = self._stripe(identifier)
+        with lock:
+            if table.acquire(identifier, self.max_requests, self.window_seconds, n):
+                return 0.0
+            return table.retry_after(identifier, self.max_requests, self.window_seconds, n)
+
+    async def acquire(self, identifier: str, n: int = 1, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until n requests fit within the limit, then reserve them
+
+        Args:
+            identifier: Key being limited
+            n: Number of requests to reserve
+            timeout: Give up after this many seconds (None waits indefinitely)
+
+        Returns:
+            True once admitted, False if the timeout expired first
+
+        Raises:
+            ValueError: If n exceeds max_requests and could never be admitted
+        """
+        import asyncio
+
+        if n > self.max_requests:
+            raise ValueError(f"Cannot acquire {n} of {self.max_requests} requests per window")
+
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        while True:
+            wait = self._acquire_or_wait(identifier, n)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            # Another waiter may take the slot first; re-check after waking
+            await asyncio.sleep(max(wait, 0.001))
+
+
+_rate_limit_tables = {}
+_rate_limit_lock = threading.Lock()
+
+
+def enhanced_is_dangerous_file_path(file_path: str) -> bool:
+    """
+    Enhanced file path validation with comprehensive system directory protection
+    """
+    return get_path_policy().check(file_path)
+
+
+def _is_lock_contention(error: Exception) -> bool:
+    """True for SQLite errors raised when another process held the lock past the busy timeout"""
+    import sqlite3
+
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def _get_rate_limit_table(
+    algorithm: str,
+    shared: bool,
+    db_path: Optional[Union[str, Path]] = None
+) -> RateLimitTable:
+    """
+    Get the cached table for an algorithm, falling back to in-memory if the shared one cannot open
+
+    Raises:
+        sqlite3.OperationalError: If the shared table is locked by other processes
+    """
+    import sqlite3
+    import sys
+
+    if shared:
+        db_path = Path(db_path) if db_path is not None else default_rate_limit_path()
+    key = (algorithm, str(db_path) if shared else False)
+    table = _rate_limit_tables.get(key)
+    if table is not None:
+        return table
+
+    with _rate_limit_lock:
+        table = _rate_limit_tables.get(key)
+        if table is None:
+            if shared:
+                try:
+                    table = SharedRateLimitTable(db_path, algorithm)
+                except (OSError, sqlite3.Error) as e:
+                    if _is_lock_contention(e):
+                        raise  # Busy, not broken: the caller denies rather than caching a fallback
+                    print(f"[SECURITY] Rate limit store {db_path} unavailable ({e}); limiting within this process",
+                          file=sys.stderr)
+            if table is None:
+                table = _rate_limit_tables.setdefault((algorithm, False), RateLimitTable(algorithm))
+            _rate_limit_tables[key] = table
+
+    return table
+
+
+def check_rate_limit(
+    identifier: str,
+    max_requests: int = 10,
+    window_seconds: int = 60,
+    algorithm: str = 'sliding_window',
+    shared: bool = True,
+    db_path: Optional[Union[str, Path]] = None
+) -> bool:
+    """
+    Check if an operation is within rate limits
+
+    Safe to call from multiple threads. When the shared table stays locked by
+    other processes past its busy timeout, the request is denied rather than
+    counted against an empty in-memory window; when it is broken otherwise,
+    requests are limited within this process. Both are reported on stderr.
+
+    Args:
+        identifier: Key being limited (tool name, session, ...)
+        max_requests: Requests allowed per window
+        window_seconds: Window length in seconds
+        algorithm: 'sliding_window' or 'token_bucket'
+        shared: Count requests across all processes rather than only within this one
+        db_path: Shared table location (default: default_rate_limit_path())
+
+    Returns:
+        True if the operation is allowed, False if rate limited
+    """
+    import sqlite3
+
+    import sys
+
+    try:
+        table = _get_rate_limit_table(algorithm, shared, db_path)
+        if isinstance(table, SharedRateLimitTable):
+            return table.acquire(identifier, max_requests, window_seconds)
+    except sqlite3.Error as e:
+        if _is_lock_contention(e):
+            # Failing open here would give every contending process its own empty window
+            print(f"[SECURITY] Rate limit store busy ({e}); request denied", file=sys.stderr)
+            return False
+        print(f"[SECURITY] Rate limit store failed ({e}); limiting within this process", file=sys.stderr)
+        table = _get_rate_limit_table(algorithm, False)
+
+    with _rate_limit_lock:
+        return table.acquire(identifier, max_requests, window_seconds)
+
+
+def get_secure_timeout(operation_type: str) -> int:
+    """
+    Get secure timeout value for different operations
+    """
+    timeout_config = {
+        'bash': 60,          # 1 minute for bash commands
+        'read': 30,          # 30 seconds for file reads
+        'write': 45,         # 45 seconds for file writes
+        'edit': 60,          # 1 minute for file edits
+        'grep': 30,          # 30 seconds for searches
+        'glob': 20,          # 20 seconds for file globbing
+        'ls': 15,            # 15 seconds for directory listings
+        'git': 120,          # 2 minutes for git operations
+        'test': 300,         # 5 minutes for test execution
+        'build': 600,        # 10 minutes for builds
+        'default': 60        # Default 1 minute
+    }
+
+    return timeout_config.get(operation_type.lower(), timeout_config['default'])
+
+
+def create_secure_config() -> Dict[str, Any]:
+    """
+    Create secure configuration with proper defaults
+    """
+    return {
+        'max_file_size': 10 * 1024 * 1024,  # 10MB max file size
+        'max_output_length': 50000,          # 50K characters max output
+        'max_log_entries': 1000,             # Max log entries before rotation
+        'rate_limit_requests': 20,           # Max requests per minute
+        'rate_limit_window': 60,             # Rate limit window in seconds
+        'entropy_thresholds': {k: dict(v) for k, v in DEFAULT_ENTROPY_THRESHOLDS.items()},
+        'validation_budget': {
+            'max_chars': 16 * 1024 * 1024,   # Characters scanned per tool input
+            'cpu_seconds': 1.0,              # CPU time spent scanning per tool input
+            'on_exceeded': 'fail_closed'     # Block inputs that could not be fully scanned
+        },
+        'allowed_extensions': [
+            '.py', '.js', '.ts', '.go', '.rs', '.rb', '.java', '.cpp', '.c',
+            '.h', '.hpp', '.css', '.html', '.md', '.txt', '.json', '.yaml',
+            '.yml', '.toml', '.ini', '.cfg', '.conf', '.sh', '.bat'
+        ],
+        'blocked_extensions': [
+            '.exe', '.dll', '.so', '.dylib', '.msi', '.deb', '.rpm',
+            '.dmg', '.pkg', '.app', '.scr', '.com', '.pif'
+        ],
+        'secure_headers': {
+            'User-Agent': 'Claude-Code-Security/1.0',
+            'X-Security-Version': '1.0'
+        }
+    }
+
+
+# Read size for the backward and forward scans done by rotate_log_file
+LOG_ROTATION_CHUNK = 64 * 1024
+
+# Size at which setup_log_rotation_for_all_logs rotates a log regardless of line count
+LOG_ROTATION_MAX_BYTES = 5 * 1024 * 1024
+
+
+def _iter_newlines_backward(f, end: int) -> Iterator[int]:
+    """Yield offsets of newlines before end, last first, ignoring a newline that ends the file"""
+    position = end
+    while position > 0:
+        start = max(0, position - LOG_ROTATION_CHUNK)
+        f.seek(start)
+        chunk = f.read(position - start)
+        index = len(chunk)
+        while True:
+            index = chunk.rfind(b'\n', 0, index)
+            if index < 0:
+                break
+            if start + index != end - 1:
+                yield start + index
+        position = start
+
+
+def _next_line_start(f, offset: int, end: int) -> int:
+    """Offset of the first line starting at or after offset"""
+    if offset <= 0:
+        return 0
+    position = offset - 1  # A newline right before offset means offset starts a line
+    while position < end:
+        f.seek(position)
+        chunk = f.read(min(LOG_ROTATION_CHUNK, end - position))
+        index = chunk.find(b'\n')
+        if index >= 0:
+            return position + index + 1
+        position += len(chunk)
+    return end
+
+
+def _rotation_offset(f, size: int, max_entries: Optional[int], max_bytes: Optional[int]) -> Optional[int]:
+    """
+    Find where the kept tail starts, or None when no limit is exceeded
+
+    Only the end of the file is read: at most max_entries lines backward, or
+    max_bytes // 2 bytes plus the rest of one line forward.
+    """
+    offsets = []
+
+    if max_entries is not None:
+        keep = max_entries // 2
+        keep_offset = size if keep <= 0 else None
+        exceeded = False
+        for seen, newline in enumerate(_iter_newlines_backward(f, size), 1):
+            if seen == keep:
+                keep_offset = newline + 1
+            if seen >= max_entries:
+                exceeded = True
+                break
+        if exceeded:
+            offsets.append(keep_offset)
+
+    if max_bytes is not None and size > max_bytes:
+        offsets.append(_next_line_start(f, size - max_bytes // 2, size))
+
+    return max(offsets) if offsets else None
+
+
+def _copy_range(source, target, start: int, end: int) -> None:
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(LOG_ROTATION_CHUNK, remaining))
+        if not chunk:
+            break
+        target.write(chunk)
+        remaining -= len(chunk)
+
+
+def rotate_log_file(
+    log_file_path: str,
+    max_entries: Optional[int] = 1000,
+    max_bytes: Optional[int] = None,
+    archive: Optional['LogArchive'] = None
+) -> bool:
+    """
+    Rotate log file when it gets too large
+
+    The whole log is kept as a backup (a hard link, so nothing is copied) and
+    replaced by a new file holding its most recent lines: the last
+    max_entries // 2 lines and/or the whole lines within the last max_bytes // 2
+    bytes. The tail is found by reading backward from the end, so time and
+    memory do not depend on the size of the log. The swap is an atomic rename
+    made while holding an flock on '<log>.lock'. Appenders that opened the log
+    before the rename keep writing to the backup; lines that reach it while
+    the tail is being copied are also carried over to the new log.
+
+    The backup is named '<log>.<timestamp>.<start>-<end>.backup', recording the
+    byte range that was carried over. Without an archive the last 5 backups are
+    kept. With one, the backup is handed to the archive, which compresses it in
+    the background and skips that range, so each line is archived once; lines
+    that reach the backup after the carry-over are archived with it.
+
+    Args:
+        log_file_path: Log to rotate
+        max_entries: Rotate when the log has more lines than this (None to disable)
+        max_bytes: Rotate when the log is larger than this many bytes (None to disable)
+        archive: LogArchive that takes the rotated-out lines instead of keeping backups
+
+    Returns:
+        True if the log was rotated
+    """
+    import fcntl
+    import shutil
+    from datetime import datetime
+
+    log_path = Path(log_file_path)
+
+    if not log_path.exists():
+        return False
+
+    try:
+        with open(log_path.with_name(log_path.name + '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                log = open(log_path, 'rb')
+            except FileNotFoundError:
+                return False
+
+            with log:
+                size = os.fstat(log.fileno()).st_size
+                offset = _rotation_offset(log, size, max_entries, max_bytes)
+                if offset is None:
+                    return False  # No rotation needed
+
+                # Create backup with timestamp (microseconds, so names sort in rotation order)
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+                backup_path = log_path.with_suffix(f'.{timestamp}.backup')
+                os.link(log_path, backup_path)
+
+                # Keep only recent entries in new log file
+                rotating_path = log_path.with_name(f'.{log_path.name}.rotating')
+                with open(rotating_path, 'wb') as new_log:
+                    _copy_range(log, new_log, offset, size)
+                shutil.copymode(log_path, rotating_path)
+                os.replace(rotating_path, log_path)
+
+                # Carry over lines appended to the old file while the tail was copied
+                appended_end = os.fstat(log.fileno()).st_size
+                if appended_end > size:
+                    with open(log_path, 'ab') as new_log:
+                        _copy_range(log, new_log, size, appended_end)
+
+                # Record the carried-over range; the backup itself is left untouched for late appenders
+                carried_path = log_path.with_suffix(f'.{timestamp}.{offset}-{appended_end}.backup')
+                os.rename(backup_path, carried_path)
+                backup_path = carried_path
+
+            # Add rotation log entry
+            rotation_entry = {
+                'timestamp': datetime.now().isoformat(),
+                'action': 'log_rotation',
+                'bytes_before': size,
+                'bytes_after': size - offset,
+                'backup_file': str(backup_path)
+            }
+
+            with open(log_path, 'a') as f:
+                f.write(json.dumps(rotation_entry) + '\n')
+
+        if archive is not None:
+            archive.submit_pending()
+            return True
+
+        # Clean up old backups (keep only last 5)
+        backup_pattern = log_path.stem + '.*' + '.backup'
+        parent_dir = log_path.parent
+        backups = sorted(parent_dir.glob(backup_pattern))
+
+        if len(backups) > 5:
+            for old_backup in backups[:-5]:
+                old_backup.unlink()
+
+        return True
+
+    except (IOError, OSError) as e:
+        # If rotation fails, log the error but don't crash
+        try:
+            error_entry = {
+                'timestamp': datetime.now().isoformat(),
+                'action': 'log_rotation_error',
+                'error': str(e)
+            }
+            with open(log_path, 'a') as f:
+                f.write(json.dumps(error_entry) + '\n')
+        except:
+            pass  # If we cannot even log the error, just continue
+
+        return False
+
+
+# Compressed archive of rotated log segments
+ARCHIVE_COMPRESSORS = {'gzip': '.gz', 'lzma': '.xz'}
+
+# Uncompressed bytes per independently compressed (and indexed) block
+ARCHIVE_BLOCK_BYTES = 256 * 1024
+
+# Seconds a rotated segment must go unmodified before it is archived and removed
+ARCHIVE_SETTLE_SECONDS = 1.0
+
+# Settle periods to wait for a segment still being written before leaving it for a later rotation
+ARCHIVE_SETTLE_ATTEMPTS = 5
+
+_TEXT_LOG_LINE = re.compile(rb'^\[(\d{4}-)?(\d\d-\d\d) (\d\d:\d\d:\d\d)\] ([A-Za-z_]+):')
+_BACKUP_TIMESTAMP = re.compile(r'^(\d{8}_\d{6}(?:_\d{6})?)(?:\.(\d+)-(\d+))?$')
+
+
+def parse_log_line(line: bytes, year: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Parse one log line into an entry
+
+    JSON lines are returned as they are; hook lines such as
+    '[2024-01-02 10:00:00] BLOCKED: ...' become a dict with an ISO timestamp,
+    a lowercase action and the message. Title-case words, as in activity.log's
+    '[01-02 10:00:00] Bash: ...', are the tool_name instead. Anything else is
+    kept as {'message': line}.
+
+    Args:
+        line: Raw line, with or without its trailing newline
+        year: Year for lines whose timestamp has none (otherwise they get no timestamp)
+
+    Returns:
+        Entry dictionary, or None for blank lines
+    """
+    line = line.strip()
+    if not line:
+        return None
+
+    if line[:1] == b'{':
+        try:
+            entry = json.loads(line.decode('utf-8'))
+            if isinstance(entry, dict):
+                return entry
+        except ValueError:
+            pass
+
+    match = _TEXT_LOG_LINE.match(line)
+    if match:
+        prefix, date, time, word = (group.decode('ascii') if group else group for group in match.groups())
+        entry: Dict[str, Any] = {}
+        if prefix or year is not None:
+            entry['timestamp'] = f"{prefix or f'{year:04d}-'}{date}T{time}"
+        if word.isupper():
+            entry['action'] = word.lower()
+        else:
+            entry['tool_name'] = word
+        entry['message'] = line[match.end():].strip().decode('utf-8', 'replace')
+        return entry
+
+    return {'message': line.decode('utf-8', 'replace')}
+
+
+def _timestamp_bound(value: Any) -> Optional[str]:
+    # Entries carry ISO 8601 timestamps, which order correctly as strings
+    if value is None or isinstance(value, str):
+        return value
+    return value.isoformat()
+
+
+class LogArchive:
+    """
+    Compressed, time-indexed archive of rotated log segments
+
+    Each segment handed over by rotate_log_file is compressed in blocks of
+    about block_bytes, every block on its own (a sequence of gzip members or
+    xz streams), so any block can be decompressed alone. A sidecar
+    'index.jsonl' records, per block, its segment, offset and length, the
+    earliest and latest timestamps it holds and a count per action; query()
+    reads the index and decompresses only the blocks that can match.
+    Compression runs on a background thread; archiving takes an flock on
+    'index.lock', so several processes can share one archive.
+
+    Appenders that opened the log before a rotation may still write to the
+    rotated segment, so a segment is archived only once it has gone
+    settle_seconds without being modified, and archived again from the start
+    if it changes while being compressed. After settle_attempts tries it is
+    left in pending() for a later rotation to retry.
+    """
+
+    def __init__(
+        self,
+        log_path: Union[str, Path],
+        archive_dir: Optional[Union[str, Path]] = None,
+        compression: str = 'gzip',
+        block_bytes: int = ARCHIVE_BLOCK_BYTES,
+        settle_seconds: float = ARCHIVE_SETTLE_SECONDS,
+        settle_attempts: int = ARCHIVE_SETTLE_ATTEMPTS
+    ):
+        """
+        Args:
+            log_path: Log whose rotated segments are archived
+            archive_dir: Archive location (default: 'archive/<log name>' next to the log)
+            compression: One of ARCHIVE_COMPRESSORS
+            block_bytes: Uncompressed bytes per indexed block
+            settle_seconds: Time a segment must go unmodified before it is archived
+            settle_attempts: Tries before a segment still being written is left for later
+
+        Raises:
+            ValueError: If the compression is unknown
+        """
+        import queue
+
+        if compression not in ARCHIVE_COMPRESSORS:
+            raise ValueError(f"Unknown compression: {compression!r} (expected one of {', '.join(ARCHIVE_COMPRESSORS)})")
+
+        self.log_path = Path(log_path)
+        self.archive_dir = Path(archive_dir) if archive_dir else self.log_path.parent / 'archive' / self.log_path.name
+        self.index_path = self.archive_dir / 'index.jsonl'
+        self.compression = compression
+        self.block_bytes = block_bytes
+        self.settle_seconds = settle_seconds
+        self.settle_attempts = settle_attempts
+        self.error: Optional[OSError] = None
+
+        self._queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def pending(self) -> List[Path]:
+        """Rotated segments of this log waiting to be archived, oldest first"""
+        prefix = self.log_path.stem + '.'
+        backups = []
+        for path in self.log_path.parent.glob(prefix + '*.backup'):
+            if _BACKUP_TIMESTAMP.match(path.name[len(prefix):-len('.backup')]):
+                backups.append(path)
+        return sorted(backups)
+
+    def submit(self, backup_path: Union[str, Path]) -> None:
+        """Queue a rotated segment for background compression"""
+        import atexit
+
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='LogArchive', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        self._queue.put(Path(backup_path))
+
+    def submit_pending(self) -> None:
+        """Queue every segment returned by pending()"""
+        for backup_path in self.pending():
+            self.submit(backup_path)
+
+    def wait(self) -> None:
+        """Block until every submitted segment has been archived"""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Archive the submitted segments and stop the background thread"""
+        import atexit
+
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+            atexit.unregister(self.close)
+
+    def _run(self) -> None:
+        while True:
+            backup_path = self._queue.get()
+            try:
+                if backup_path is None:
+                    return
+                self.archive_segment(backup_path)
+            except OSError as e:
+                self.error = e  # The segment stays in pending() and is retried later
+            finally:
+                self._queue.task_done()
+
+    def archive_segment(self, backup_path: Union[str, Path]) -> Optional[Path]:
+        """
+        Compress one rotated segment into the archive and remove it
+
+        Waits, without holding the archive lock, until the segment has gone
+        settle_seconds without being modified; after settle_attempts tries
+        (each wait or change during compression counts) the segment is left
+        in place. The byte range that rotate_log_file carried over to the new
+        log, named in the segment's file name, is left out.
+
+        Args:
+            backup_path: Segment written by rotate_log_file
+
+        Returns:
+            Path of the compressed segment, or None if it was already archived
+            or is still being written to
+
+        Raises:
+            ValueError: If backup_path is not a rotated segment of this log
+        """
+        import fcntl
+        import time
+
+        backup_path = Path(backup_path)
+        match = _BACKUP_TIMESTAMP.match(backup_path.name[len(self.log_path.stem) + 1:-len('.backup')])
+        if match is None or not backup_path.name.startswith(self.log_path.stem + '.'):
+            raise ValueError(f"Not a rotated segment of {self.log_path.name}: {backup_path.name}")
+        timestamp, carried_start, carried_end = match.groups()
+        carried = (int(carried_start), int(carried_end)) if carried_start is not None else None
+        segment = self.archive_dir / f'{timestamp}.log{ARCHIVE_COMPRESSORS[self.compression]}'
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        for _ in range(self.settle_attempts):
+            try:
+                settling = self.settle_seconds - (time.time() - os.stat(backup_path).st_mtime)
+            except FileNotFoundError:
+                return None  # Archived by another process
+            if settling > 0:
+                time.sleep(settling)
+                continue
+
+            with open(self.archive_dir / 'index.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+                try:
+                    before = os.stat(backup_path)
+                except FileNotFoundError:
+                    return None  # Archived by another process
+
+                # A crash after indexing leaves the segment in the index; only the backup remains to remove
+                if not any(record['segment'] == segment.name for record in self._read_index()):
+                    if time.time() - before.st_mtime < self.settle_seconds:
+                        continue  # Written to since the check above; settle again unlocked
+                    records = self._compress(backup_path, segment, carried)
+                    after = os.stat(backup_path)
+                    if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                        continue  # A late appender wrote to it meanwhile
+
+                    with open(self.index_path, 'a') as index:
+                        index.write(''.join(json.dumps(record) + '\n' for record in records))
+                        index.flush()
+                        os.fsync(index.fileno())
+
+                backup_path.unlink()
+                return segment
+
+        return None  # Still being written: stays in pending() for a later rotation
+
+    @staticmethod
+    def _segment_lines(source, carried: Optional[Tuple[int, int]]) -> Iterator[bytes]:
+        # Lines of a rotated segment without the bytes carried over to the new log
+        position = 0
+        for line in source:
+            end = position + len(line)
+            if carried is not None and position < carried[1] and end > carried[0]:
+                line = line[:max(0, carried[0] - position)] + line[max(0, carried[1] - position):]
+            position = end
+            if line:
+                yield line
+
+    def _compress(self, backup_path: Path, segment: Path, carried: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
+        partial = segment.with_name(f'.{segment.name}.partial')
+        records = []
+
+        with open(backup_path, 'rb') as source, open(partial, 'wb') as target:
+            block: List[bytes] = []
+            size = 0
+            for line in self._segment_lines(source, carried):
+                block.append(line)
+                size += len(line)
+                if size >= self.block_bytes:
+                    records.append(self._write_block(target, segment.name, block))
+                    block, size = [], 0
+            if block:
+                records.append(self._write_block(target, segment.name, block))
+            target.flush()
+            os.fsync(target.fileno())
+
+        os.chmod(partial, 0o600)
+        os.replace(partial, segment)
+        return records
+
+    def _write_block(self, target, segment_name: str, lines: List[bytes]) -> Dict[str, Any]:
+        start = end = None
+        actions: Dict[str, int] = {}
+        entries = 0
+
+        for line in lines:
+            entry = parse_log_line(line)
+            if entry is None:
+                continue
+            entries += 1
+            timestamp = entry.get('timestamp')
+            if isinstance(timestamp, str):
+                start = timestamp if start is None else min(start, timestamp)
+                end = timestamp if end is None else max(end, timestamp)
+            action = entry.get('action')
+            if isinstance(action, str):
+                actions[action] = actions.get(action, 0) + 1
+
+        data = b''.join(lines)
+        if self.compression == 'gzip':
+            import gzip
+            data = gzip.compress(data, compresslevel=6, mtime=0)
+        else:
+            import lzma
+            data = lzma.compress(data)
+
+        offset = target.tell()
+        target.write(data)
+        return {
+            'segment': segment_name,
+            'offset': offset,
+            'length': len(data),
+            'start': start,
+            'end': end,
+            'entries': entries,
+            'actions': actions
+        }
+
+    def _read_index(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.index_path, 'rb') as index:
+                lines = index.readlines()
+        except FileNotFoundError:
+            return []
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # Torn last line after a crash
+        return records
+
+    def select_blocks(
+        self,
+        start: Any = None,
+        end: Any = None,
+        actions: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Index records of the blocks that may hold matching entries
+
+        Args:
+            start: Earliest timestamp, inclusive (datetime or ISO string)
+            end: Latest timestamp, exclusive (datetime or ISO string; '2024-01-03' ends on 2024-01-02)
+            actions: Only blocks holding at least one of these actions
+
+        Returns:
+            Matching index records in archive order
+        """
+        start, end = _timestamp_bound(start), _timestamp_bound(end)
+        wanted = set(actions) if actions else None
+
+        selected = []
+        for record in self._read_index():
+            if start is not None or end is not None:
+                if record['start'] is None:
+                    continue
+                if start is not None and record['end'] < start:
+                    continue
+                if end is not None and record['start'] >= end:
+                    continue
+            if wanted is not None and wanted.isdisjoint(record['actions']):
+                continue
+            selected.append(record)
+        return selected
+
+    def query(
+        self,
+        start: Any = None,
+        end: Any = None,
+        actions: Optional[List[str]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield archived entries in a time range and/or with given actions
+
+        Only the blocks returned by select_blocks() are read and decompressed.
+
+        Args:
+            start: Earliest timestamp, inclusive (datetime or ISO string)
+            end: Latest timestamp, exclusive (datetime or ISO string)
+            actions: Only entries with one of these actions
+
+        Yields:
+            Entry dictionaries, as returned by parse_log_line()
+        """
+        import gzip
+        import lzma
+
+        lower, upper = _timestamp_bound(start), _timestamp_bound(end)
+        wanted = set(actions) if actions else None
+        segments: Dict[str, Any] = {}
+
+        try:
+            for record in self.select_blocks(lower, upper, actions):
+                name = record['segment']
+                if name not in segments:
+                    try:
+                        segments[name] = open(self.archive_dir / name, 'rb')
+                    except FileNotFoundError:
+                        segments[name] = None  # Pruned since the index was read
+                segment = segments[name]
+                if segment is None:
+                    continue
+
+                segment.seek(record['offset'])
+                data = segment.read(record['length'])
+                data = gzip.decompress(data) if name.endswith('.gz') else lzma.decompress(data)
+
+                for line in data.splitlines():
+                    entry = parse_log_line(line)
+                    if entry is None:
+                        continue
+                    if lower is not None or upper is not None:
+                        timestamp = entry.get('timestamp')
+                        if not isinstance(timestamp, str):
+                            continue
+                        if (lower is not None and timestamp < lower) or (upper is not None and timestamp >= upper):
+                            continue
+                    if wanted is not None and entry.get('action') not in wanted:
+                        continue
+                    yield entry
+        finally:
+            for segment in segments.values():
+                if segment is not None:
+                    segment.close()
+
+    def prune(self, before: Any) -> int:
+        """
+        Delete archived segments whose entries are all older than a timestamp
+
+        Args:
+            before: Cutoff (datetime or ISO string)
+
+        Returns:
+            Number of segments deleted
+        """
+        import fcntl
+
+        before = _timestamp_bound(before)
+        if not self.index_path.exists():
+            return 0
+
+        with open(self.archive_dir / 'index.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            records = self._read_index()
+            newest: Dict[str, Optional[str]] = {}
+            for record in records:
+                name = record['segment']
+                if record['end'] is None:
+                    newest.setdefault(name, None)
+                elif newest.get(name) is None or record['end'] > newest[name]:
+                    newest[name] = record['end']
+            expired = {name for name, end in newest.items() if end is not None and end < before}
+            if not expired:
+                return 0
+
+            # Drop the index records before the segments, so queries never see missing blocks
+            rewritten = self.index_path.with_name('.index.jsonl.partial')
+            with open(rewritten, 'w') as index:
+                index.write(''.join(json.dumps(r) + '\n' for r in records if r['segment'] not in expired))
+                index.flush()
+                os.fsync(index.fileno())
+            os.replace(rewritten, self.index_path)
+
+            for name in expired:
+                try:
+                    (self.archive_dir / name).unlink()
+                except FileNotFoundError:
+                    pass
+            return len(expired)
+
+
+_log_archives: Dict[str, LogArchive] = {}
+_log_archives_lock = threading.Lock()
+
+
+def get_log_archive(log_path: Union[str, Path]) -> LogArchive:
+    """Get the shared LogArchive for a log file"""
+    key = os.path.abspath(log_path)
+    with _log_archives_lock:
+        archive = _log_archives.get(key)
+        if archive is None:
+            archive = _log_archives[key] = LogArchive(key)
+        return archive
+
+
+# Indexed queries over the security and activity logs
+LOG_INDEX_BUCKETS = {'minute': 60, 'hour': 3600, 'day': 86400}
+LOG_INDEX_GROUPS = ('action', 'tool_name', 'log')
+
+
+def default_log_index_path() -> Path:
+    """Default location of the SQLite log index"""
+    return Path.home() / '.claude' / 'log_index.sqlite'
+
+
+def default_log_paths() -> List[Path]:
+    """Logs indexed by default: JSON/JSONL entries and the hooks' text logs"""
+    paths = []
+    for logs_dir in (Path.home() / '.claude' / 'logs', Path(__file__).parent / 'logs'):
+        for pattern in ('*.json', '*.jsonl', '*.log'):
+            paths.extend(sorted(logs_dir.glob(pattern)))
+    return list(dict.fromkeys(paths))
+
+
+def _epoch(value: Any) -> Optional[float]:
+    # Naive timestamps are local time, as written by datetime.now() and date(1)
+    from datetime import datetime
+
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+def _input_hash_key(value: Any) -> Optional[int]:
+    # Stored as a signed 64-bit integer: ints as they are (legacy hash() values),
+    # hex digests by their first 16 digits, anything else by a blake2b digest
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, str) and re.fullmatch(r'-?\d{1,20}', value):
+        value = int(value)
+    if isinstance(value, int):
+        key = value
+    else:
+        text = str(value)
+        try:
+            key = int(text[:16], 16)
+        except ValueError:
+            import hashlib
+            key = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+    return (key + (1 << 63)) % (1 << 64) - (1 << 63)
+
+
+class LogIndex:
+    """
+    Incremental SQLite index over JSONL and text log files
+
+    One row per log entry holds its time (epoch seconds), tool_name, action and
+    input_hash, with tool names and actions stored as ids into a label table,
+    so millions of entries stay small and filtered counts are answered from
+    indexes instead of rereading the logs. Counts per hour, tool and action
+    are also kept in a rollup table, which answers whole-hour aggregates
+    without touching the entries.
+
+    update() reads each log from the offset it reached last time. When a log
+    has been replaced or truncated, the rest of the previous file is read
+    first if it is still reachable (rotate_log_file backups and 'log.N' renames
+    are hard links to it). The tail that rotate_log_file carried into the new
+    file, everything before its 'log_rotation' entry, is then skipped as far as
+    it was already indexed. Lines rotated out and deleted before an update
+    ran are not indexed; LogArchive.query() covers archived history.
+    """
+
+    def __init__(self, db_path: Optional[Union[str, Path]] = None, timeout: float = 5.0):
+        """
+        Args:
+            db_path: SQLite index file (default: ~/.claude/log_index.sqlite)
+            timeout: Seconds to wait for another process updating the index
+
+        Raises:
+            sqlite3.Error: If the database cannot be opened
+        """
+        import sqlite3
+
+        self.db_path = Path(db_path) if db_path else default_log_index_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.db_path), timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._lock = threading.Lock()
+
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS log_files (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL,
+                device INTEGER, inode INTEGER, offset INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS log_labels (id INTEGER PRIMARY KEY, label TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS log_entries (
+                file_id INTEGER NOT NULL, ts INTEGER, tool INTEGER, action INTEGER, input_hash INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS log_entries_ts ON log_entries (ts);
+            CREATE INDEX IF NOT EXISTS log_entries_action ON log_entries (action, ts);
+            CREATE INDEX IF NOT EXISTS log_entries_tool ON log_entries (tool, ts);
+            CREATE INDEX IF NOT EXISTS log_entries_hash ON log_entries (input_hash) WHERE input_hash IS NOT NULL;
+            CREATE TABLE IF NOT EXISTS log_rollup (
+                file_id INTEGER NOT NULL, hour INTEGER NOT NULL, tool INTEGER NOT NULL, action INTEGER NOT NULL,
+                count INTEGER NOT NULL, PRIMARY KEY (hour, file_id, tool, action)
+            ) WITHOUT ROWID;
+        """)
+        self._labels = dict(self._db.execute('SELECT label, id FROM log_labels'))
+        self._hour_epochs: Dict[str, Optional[float]] = {}
+        self._label_names = {label_id: label for label, label_id in self._labels.items()}
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self._db.close()
+
+    def __enter__(self) -> 'LogIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def update(self, paths: Optional[List[Union[str, Path]]] = None) -> int:
+        """
+        Index whatever was appended to the logs since the last update
+
+        Args:
+            paths: Logs to index (default: default_log_paths())
+
+        Returns:
+            Number of entries added
+        """
+        added = 0
+        with self._lock:
+            for path in (default_log_paths() if paths is None else paths):
+                added += self._update_file(Path(path).absolute())
+        return added
+
+    def _update_file(self, path: Path) -> int:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return 0
+
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._db.execute(
+                'SELECT id, device, inode, offset FROM log_files WHERE path = ?', (str(path),)
+            ).fetchone()
+            if row is None:
+                file_id = self._db.execute('INSERT INTO log_files (path) VALUES (?)', (str(path),)).lastrowid
+                added, offset = self._index_lines(file_id, path, 0)
+            elif (row[1], row[2]) == (st.st_dev, st.st_ino) and st.st_size >= row[3]:
+                file_id = row[0]
+                added, offset = self._index_lines(file_id, path, row[3])
+            else:
+                # Replaced or truncated: finish the previous file, then skip what rotation carried over
+                file_id, indexed_end = row[0], row[3]
+                added = 0
+                previous = self._find_previous(path, row[1], row[2])
+                if previous is not None:
+                    added, indexed_end = self._index_lines(file_id, previous, indexed_end)
+                more, offset = self._index_lines(file_id, path, 0, carried_end=indexed_end)
+                added += more
+
+            self._db.execute(
+                'UPDATE log_files SET device = ?, inode = ?, offset = ? WHERE id = ?',
+                (st.st_dev, st.st_ino, offset, file_id)
+            )
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        return added
+
+    @staticmethod
+    def _find_previous(path: Path, device: Optional[int], inode: Optional[int]) -> Optional[Path]:
+        if inode is None:
+            return None
+        candidates = set(path.parent.glob(path.name + '.*')) | set(path.parent.glob(path.stem + '.*.backup'))
+        for candidate in candidates:
+            try:
+                st = os.stat(candidate)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) == (device, inode):
+                return candidate
+        return None
+
+    def _index_lines(self, file_id: int, path: Path, start: int, carried_end: Optional[int] = None) -> Tuple[int, int]:
+        """Index complete lines from start; returns (entries added, offset after the last complete line)"""
+        from datetime import datetime
+
+        try:
+            log = open(path, 'rb')
+        except FileNotFoundError:
+            return 0, start
+
+        with log:
+            modified = os.fstat(log.fileno()).st_mtime
+            year = datetime.fromtimestamp(modified).year
+            log.seek(start)
+            rows = []
+            position = start
+            # Rows of a replaced log wait here until its 'log_rotation' entry shows what was carried over
+            held: Optional[List[Tuple[int, Tuple]]] = [] if carried_end is not None else None
+
+            for line in log:
+                if not line.endswith(b'\n'):
+                    break  # Partial line still being written
+
+                entry = parse_log_line(line, year)
+                if entry is not None:
+                    # '[MM-DD HH:MM:SS] ...' activity lines carry no year
+                    row = self._row(file_id, entry, modified, line[3:4] == b'-')
+                    if held is None:
+                        rows.append(row)
+                    elif entry.get('action') == 'log_rotation' and 'bytes_before' in entry:
+                        kept_from = entry['bytes_before'] - entry.get('bytes_after', 0)
+                        skip = min(position, max(0, carried_end - kept_from))
+                        rows.extend(held_row for held_position, held_row in held if held_position >= skip)
+                        rows.append(row)
+                        held = None
+                    else:
+                        held.append((position, row))
+                position += len(line)
+
+            if held:
+                rows.extend(held_row for _, held_row in held)  # Not rotated by rotate_log_file
+
+        from collections import Counter
+
+        self._db.executemany('INSERT INTO log_entries VALUES (?, ?, ?, ?, ?)', rows)
+        hours = Counter(
+            (row[0], row[1] - row[1] % 3600, row[2] or 0, row[3] or 0) for row in rows if row[1] is not None
+        )
+        self._db.executemany(
+            'INSERT INTO log_rollup VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (hour, file_id, tool, action) DO UPDATE SET count = count + excluded.count',
+            [(*key, count) for key, count in hours.items()]
+        )
+        return len(rows), position
+
+    def _timestamp_epoch(self, timestamp: str) -> Optional[int]:
+        # Local-time conversion is the slow part, so it is done once per hour and cached
+        if len(timestamp) >= 19 and timestamp[13] == ':' and timestamp[16] == ':' and \
+                (len(timestamp) == 19 or (timestamp[19] == '.' and timestamp[20:].isdigit())):
+            hour = timestamp[:13]
+            base = self._hour_epochs.get(hour, False)
+            if base is False:
+                try:
+                    base = self._hour_epochs[hour] = _epoch(hour + ':00:00')
+                except ValueError:
+                    base = self._hour_epochs[hour] = None
+            if base is not None and timestamp[14:16].isdigit() and timestamp[17:19].isdigit():
+                return int(base) + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+        try:
+            return int(_epoch(timestamp))  # Time zones and other ISO forms
+        except ValueError:
+            return None
+
+    def _row(self, file_id: int, entry: Dict[str, Any], modified: float, year_inferred: bool) -> Tuple:
+        ts = None
+        timestamp = entry.get('timestamp')
+        if isinstance(timestamp, str):
+            ts = self._timestamp_epoch(timestamp)
+            if ts is not None and year_inferred and ts > modified + 86400:
+                ts = self._timestamp_epoch(f'{int(timestamp[:4]) - 1:04d}{timestamp[4:]}')  # Last year's line
+
+        return (
+            file_id,
+            ts,
+            self._label_id(entry.get('tool_name')),
+            self._label_id(entry.get('action')),
+            _input_hash_key(entry.get('input_hash'))
+        )
+
+    def _label_id(self, label: Any) -> Optional[int]:
+        if not isinstance(label, str):
+            return None
+        label_id = self._labels.get(label)
+        if label_id is None:
+            self._db.execute('INSERT OR IGNORE INTO log_labels (label) VALUES (?)', (label,))
+            label_id = self._db.execute('SELECT id FROM log_labels WHERE label = ?', (label,)).fetchone()[0]
+            self._labels[label] = label_id
+            self._label_names[label_id] = label
+        return label_id
+
+    def _where(
+        self,
+        start: Any,
+        end: Any,
+        tool_name: Optional[str],
+        action: Optional[str],
+        input_hash: Optional[str],
+        logs: Optional[List[Union[str, Path]]],
+        time_column: str = 'ts'
+    ) -> Tuple[str, List[Any]]:
+        clauses = []
+        params: List[Any] = []
+        if start is not None:
+            clauses.append(f'{time_column} >= ?')
+            params.append(_epoch(start))
+        if end is not None:
+            clauses.append(f'{time_column} < ?')
+            params.append(_epoch(end))
+        for column, label in (('tool', tool_name), ('action', action)):
+            if label is not None:
+                clauses.append(f'{column} = ?')
+                params.append(self._labels.get(label, -1))
+        if input_hash is not None:
+            clauses.append('input_hash = ?')
+            params.append(_input_hash_key(input_hash))
+        if logs is not None:
+            paths = [str(Path(log).absolute()) for log in logs]
+            clauses.append(f"file_id IN (SELECT id FROM log_files WHERE path IN ({', '.join('?' for _ in paths)}))")
+            params.extend(paths)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def count(
+        self,
+        start: Any = None,
+        end: Any = None,
+        tool_name: Optional[str] = None,
+        action: Optional[str] = None,
+        input_hash: Optional[str] = None,
+        logs: Optional[List[Union[str, Path]]] = None
+    ) -> int:
+        """
+        Count indexed entries matching every given filter
+
+        Args:
+            start: Earliest time, inclusive (datetime, ISO string or epoch seconds)
+            end: Latest time, exclusive
+            tool_name: Only entries for this tool
+            action: Only entries with this action (e.g. 'blocked')
+            input_hash: Only entries for this input hash
+            logs: Only entries from these log files
+
+        Returns:
+            Number of matching entries
+        """
+        where, params = self._where(start, end, tool_name, action, input_hash, logs)
+        with self._lock:
+            return self._db.execute(f'SELECT COUNT(*) FROM log_entries{where}', params).fetchone()[0]
+
+    def entries(
+        self,
+        start: Any = None,
+        end: Any = None,
+        tool_name: Optional[str] = None,
+        action: Optional[str] = None,
+        input_hash: Optional[str] = None,
+        logs: Optional[List[Union[str, Path]]] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Matching entries in time order (filters as for count())
+
+        Returns:
+            Dictionaries with timestamp, tool_name, action, input_hash and log;
+            input_hash is the 64-bit key the index stores, usable as a filter
+        """
+        from datetime import datetime
+
+        where, params = self._where(start, end, tool_name, action, input_hash, logs)
+        sql = (
+            'SELECT e.ts, e.tool, e.action, e.input_hash, f.path FROM log_entries e '
+            f'JOIN log_files f ON f.id = e.file_id{where} ORDER BY e.ts, e.rowid'
+        )
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [
+            {
+                'timestamp': datetime.fromtimestamp(ts).isoformat() if ts is not None else None,
+                'tool_name': self._label_names.get(tool),
+                'action': self._label_names.get(action),
+                'input_hash': input_hash,
+                'log': path
+            }
+            for ts, tool, action, input_hash, path in rows
+        ]
+
+    def aggregate(
+        self,
+        bucket: Optional[Union[str, int]] = None,
+        group_by: Optional[str] = None,
+        start: Any = None,
+        end: Any = None,
+        tool_name: Optional[str] = None,
+        action: Optional[str] = None,
+        input_hash: Optional[str] = None,
+        logs: Optional[List[Union[str, Path]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Count matching entries per time bucket and/or per group
+
+        With a bucket, entries without a timestamp are left out. Whole-hour
+        buckets with hour-aligned (or no) start and end and no input_hash
+        filter are read from the hourly rollup.
+
+        Args:
+            bucket: 'minute', 'hour', 'day' or a width in seconds (local time)
+            group_by: One of LOG_INDEX_GROUPS
+            start, end, tool_name, action, input_hash, logs: Filters as for count()
+
+        Returns:
+            One dictionary per bucket/group with its 'count', in order
+
+        Raises:
+            ValueError: If the bucket or group is unknown
+        """
+        from datetime import datetime
+
+        width = LOG_INDEX_BUCKETS.get(bucket, bucket) if bucket is not None else None
+        if width is not None and (not isinstance(width, int) or width <= 0):
+            raise ValueError(f"Unknown bucket: {bucket!r} (expected one of {', '.join(LOG_INDEX_BUCKETS)} or seconds)")
+        if group_by is not None and group_by not in LOG_INDEX_GROUPS:
+            raise ValueError(f"Unknown group: {group_by!r} (expected one of {', '.join(LOG_INDEX_GROUPS)})")
+
+        if width is None and group_by is None:
+            return [{'count': self.count(start, end, tool_name, action, input_hash, logs)}]
+
+        # Buckets align to local midnight using the current UTC offset
+        shift = int(datetime.now().astimezone().utcoffset().total_seconds())
+        rollup = (
+            width is not None and width % 3600 == 0 and shift % 3600 == 0 and input_hash is None
+            and all(bound is None or _epoch(bound) % 3600 == 0 for bound in (start, end))
+        )
+        time_column = 'hour' if rollup else 'ts'
+        where, params = self._where(start, end, tool_name, action, input_hash, logs, time_column)
+
+        keys = []
+        if width is not None:
+            keys.append(f'(({time_column} + {shift}) / {width}) * {width} - {shift}')
+            if not rollup:
+                where += (' AND ' if where else ' WHERE ') + 'ts IS NOT NULL'
+        if group_by is not None:
+            keys.append({'action': 'action', 'tool_name': 'tool', 'log': 'file_id'}[group_by])
+
+        key_sql = ', '.join(keys)
+        table, total = ('log_rollup', 'SUM(count)') if rollup else ('log_entries', 'COUNT(*)')
+        sql = f'SELECT {key_sql}, {total} FROM {table}{where} GROUP BY {key_sql} ORDER BY {key_sql}'
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+            paths = dict(self._db.execute('SELECT id, path FROM log_files')) if group_by == 'log' else {}
+
+        results = []
+        for row in rows:
+            result: Dict[str, Any] = {}
+            values = list(row[:-1])
+            if width is not None:
+                ts = values.pop(0)
+                result['bucket'] = datetime.fromtimestamp(ts).isoformat() if ts is not None else None
+            if group_by == 'log':
+                result['log'] = paths.get(values[0])
+            elif group_by is not None:
+                result[group_by] = self._label_names.get(values[0])
+            result['count'] = row[-1]
+            results.append(result)
+        return results
+
+
+def setup_log_rotation_for_all_logs() -> None:
+    """
+    Set up log rotation for all log files in the logs directory
+
+    Rotated lines go to each log's compressed archive (see LogArchive). The
+    security audit log (default_audit_log_path()) is included.
+    """
+    from pathlib import Path
+
+    logs_dir = Path(__file__).parent / 'logs'
+    log_files = list(logs_dir.glob('*.json')) if logs_dir.exists() else []
+
+    audit_log = default_audit_log_path()
+    if audit_log.exists():
+        log_files.append(audit_log)
+
+    # Rotate all .json log files and the audit log
+    for log_file in log_files:
+        rotate_log_file(str(log_file), max_entries=1000, max_bytes=LOG_ROTATION_MAX_BYTES,
+                        archive=get_log_archive(log_file))
+
+
+# Hook rule sets, mirrored from scripts/hooks/security_bash.sh and security_files.sh
+# (POSIX [[:space:]] written as \s); keep both sides in sync
+BASH_DANGEROUS_PATTERNS = {
+    'rm_rf_root': r'rm\s+-rf\s+/',                  # rm -rf /
+    'rm_fr_root': r'rm\s+-fr\s+/',                  # rm -fr /
+    'rm_r_f_root': r'rm\s+-r\s+-f\s+/',             # rm -r -f /
+    'rm_f_r_root': r'rm\s+-f\s+-r\s+/',             # rm -f -r /
+    'sudo_rm': r'sudo\s+rm',                        # sudo rm anything
+    'mkfs': r'mkfs',                                # Format filesystem
+    'dd_to_device': r'dd\s+if=.+of=/dev',           # Write to device
+    'chmod_777_recursive': r'chmod\s+777\s+-R',     # Recursive 777
+    'chmod_recursive_777': r'chmod\s+-R\s+777',     # Recursive 777 (alt)
+    'write_to_disk': r'>\s*/dev/sd[a-z]',           # Write to disk
+    'fork_bomb': r':\(\)\{\s*:\|:&',                # Fork bomb
+    'curl_pipe_bash': r'curl.+\|\s*bash',           # curl | bash
+    'curl_pipe_sh': r'curl.+\|\s*sh',               # curl | sh
+    'wget_pipe_bash': r'wget.+\|\s*bash',           # wget | bash
+    'wget_pipe_sh': r'wget.+\|\s*sh',               # wget | sh
+    'subshell_pipe_bash': r'\$\(.+\)\s*\|\s*bash',  # $(cmd) | bash
+    'netcat_exec': r'nc\s.+-e',                     # Netcat reverse shell
+    'interactive_bash': r'bash\s+-i',               # Interactive bash (reverse shell pattern)
+}
+
+BASH_SYSTEM_PATHS = ['/etc/passwd', '/etc/shadow', '/etc/sudoers', '/root/', '~root/']
+
+BASH_SENSITIVE_KEYWORDS = ['password', 'secret', 'token', 'key', 'credential', 'auth']
+
+SENSITIVE_FILE_PATTERNS = [
+    r'(^|/)\.env$',                                  # .env files (exact)
+    r'(^|/)\.env\.[^/]+$',                           # .env.local, .env.production
+    r'(^|/)credentials\.(json|ya?ml|xml|ini|txt)$',  # credentials.json etc
+    r'(^|/)secrets\.(json|ya?ml|xml|ini|txt)$',      # secrets.yaml etc
+    r'\.pem$',                                       # PEM certificates
+    r'\.key$',                                       # Private keys
+    r'(^|/)id_rsa$',                                 # SSH private key
+    r'(^|/)id_ed25519$',                             # SSH private key
+    r'(^|/)\.ssh/config$',                           # SSH config
+    r'(^|/)\.aws/credentials$',                      # AWS credentials
+    r'(^|/)\.npmrc$',                                # NPM config (may have tokens)
+    r'(^|/)\.pypirc$',                               # PyPI config
+    r'(^|/)\.git/config$',                           # Git config (may have tokens)
+    r'(^|/)\.netrc$',                                # Netrc credentials
+]
+
+FILE_SYSTEM_PATHS = ('/etc/', '/root/', '/var/log/', '/sys/', '/proc/')
+
+# Characters IGNORECASE matches to an ASCII letter whose str.lower() does not
+# produce that letter alone (İ lowers to 'i' plus a combining dot)
+_KEYWORD_CASE_FOLD = {**_CASE_FOLD_EXTRAS, 0x130: 'i'}
+
+
+class CommandClassifier:
+    """
+    Compiled classifier for the Bash hook rules
+
+    Verdicts are identical to the hook's grep loop: dangerous patterns first,
+    then system paths, then sensitive keywords, each regex applied per line.
+    Every dangerous pattern has a literal that any match must contain (e.g.
+    'of=/dev' for dd, '/dev/sd' for disk writes); each distinct literal is
+    looked for once with a plain substring search, and only rules whose
+    literal is present run their regex. Most commands contain none, so they
+    are cleared without running any regex. Rules keep substring semantics
+    (mkfs inside mkfs.ext4, sudo rm inside sudo rmdir) rather than matching
+    whole shell words, because the shell fallback must agree with them.
+    """
+
+    def __init__(
+        self,
+        dangerous_patterns: Optional[Dict[str, str]] = None,
+        system_paths: Optional[List[str]] = None,
+        sensitive_keywords: Optional[List[str]] = None
+    ):
+        """
+        Args:
+            dangerous_patterns: Rule id -> regex, in priority order (default: BASH_DANGEROUS_PATTERNS)
+            system_paths: Literal paths that block a command (default: BASH_SYSTEM_PATHS)
+            sensitive_keywords: Case-insensitive words that mark a command for redacted logging
+        """
+        if dangerous_patterns is None:
+            dangerous_patterns = BASH_DANGEROUS_PATTERNS
+        self.system_paths = tuple(BASH_SYSTEM_PATHS if system_paths is None else system_paths)
+        self.sensitive_keywords = tuple(
+            keyword.lower() for keyword in (BASH_SENSITIVE_KEYWORDS if sensitive_keywords is None else sensitive_keywords)
+        )
+
+        # literal -> [(rule id, compiled regex)], in first-use order so priority is kept
+        self._gates = {}
+        self._ungated = []
+        for rule_id, pattern in dangerous_patterns.items():
+            rule = (rule_id, re.compile(pattern))
+            literals = [group[0] for group in _required_literals(pattern) if len(group) == 1]
+            if literals:
+                self._gates.setdefault(max(literals, key=len), []).append(rule)
+            else:
+                self._ungated.append(rule)
+
+        self._priority = {rule_id: index for index, rule_id in enumerate(dangerous_patterns)}
+
+    def classify(self, command: str) -> Dict[str, Any]:
+        """
+        Classify one command
+
+        Args:
+            command: Shell command from a Bash tool call
+
+        Returns:
+            Dict with 'allowed', 'reason' ('dangerous_pattern', 'system_path' or None),
+            'rule' (id of the dangerous pattern or the system path matched) and
+            'sensitive' (command mentions credentials and should be logged redacted)
+        """
+        candidates = list(self._ungated)
+        for literal, rules in self._gates.items():
+            if literal in command:
+                candidates.extend(rules)
+
+        if candidates:
+            candidates.sort(key=lambda rule: self._priority[rule[0]])
+            lines = command.split('\n')  # grep matches line by line
+            for rule_id, regex in candidates:
+                if any(regex.search(line) for line in lines):
+                    return {'allowed': False, 'reason': 'dangerous_pattern', 'rule': rule_id, 'sensitive': False}
+
+        for path in self.system_paths:
+            if path in command:
+                return {'allowed': False, 'reason': 'system_path', 'rule': path, 'sensitive': False}
+
+        folded = command if command.isascii() else command.translate(_KEYWORD_CASE_FOLD)
+        folded = folded.lower()
+        sensitive = any(keyword in folded for keyword in self.sensitive_keywords)
+        return {'allowed': True, 'reason': None, 'rule': None, 'sensitive': sensitive}
+
+    def classify_many(self, commands: Iterator[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Classify a stream of commands
+
+        Args:
+            commands: Iterable of shell commands
+
+        Yields:
+            One classify() result per command
+        """
+        classify = self.classify
+        for command in commands:
+            yield classify(command)
+
+
+_command_classifier = None
+
+
+def get_command_classifier() -> CommandClassifier:
+    """
+    Get the shared CommandClassifier, compiled on first use
+
+    Returns:
+        CommandClassifier for the Bash hook rules
+    """
+    global _command_classifier
+
+    if _command_classifier is None:
+        _command_classifier = CommandClassifier()
+
+    return _command_classifier
+
+
+_sensitive_file_regex = None
+
+
+def check_bash_command(command: str) -> Dict[str, Any]:
+    """
+    Apply the Bash hook rules to a command
+
+    Args:
+        command: Shell command from a Bash tool call
+
+    Returns:
+        CommandClassifier.classify() result
+    """
+    return get_command_classifier().classify(command)
+
+
+def check_file_access(file_path: str) -> Dict[str, Any]:
+    """
+    Apply the Edit/Write hook rules to a file path
+
+    Args:
+        file_path: Target path from a file tool call
+
+    Returns:
+        Dict with 'allowed', 'reason' ('sensitive_file', 'system_path' or None)
+        and 'sensitive' (always False)
+    """
+    global _sensitive_file_regex
+
+    if _sensitive_file_regex is None:
+        _sensitive_file_regex = re.compile(
+            '|'.join(f'(?:{pattern})' for pattern in SENSITIVE_FILE_PATTERNS), re.IGNORECASE
+        )
+
+    if _sensitive_file_regex.search(file_path):
+        return {'allowed': False, 'reason': 'sensitive_file', 'sensitive': False}
+
+    if file_path.startswith(FILE_SYSTEM_PATHS):
+        return {'allowed': False, 'reason': 'system_path', 'sensitive': False}
+
+    return {'allowed': True, 'reason': None, 'sensitive': False}
+
+
+# Checks the security daemon answers, by request 'check' name
+HOOK_CHECKS = {
+    'bash': check_bash_command,
+    'file': check_file_access,
+}
+
+# Tool input field and default tool name recorded in the audit log for each hook check
+HOOK_CHECK_FIELDS = {
+    'bash': ('command', 'Bash'),
+    'file': ('file_path', 'unknown'),
+}
+
+# Logged in place of a checked value that is sensitive or holds a secret, as the shell hooks do
+HOOK_REDACTED_VALUE = '[REDACTED - contained sensitive keywords]'
+
+
+def append_audit_log_entry(entry: Dict[str, Any], log_path: Optional[Union[str, Path]] = None) -> None:
+    """
+    Append one entry to the audit log without starting an AuditLogWriter
+
+    For short-lived processes such as the hook client: a single O_APPEND write
+    under the same shared lock the writer uses, with no background thread and
+    no fsync.
+
+    Args:
+        entry: Log entry
+        log_path: Log to append to (default: default_audit_log_path())
+
+    Raises:
+        OSError: If the log cannot be written
+    """
+    import fcntl
+
+    log_path = Path(log_path or default_audit_log_path())
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    data = (json.dumps(entry) + '\n').encode('utf-8')
+
+    with open(log_path.with_name(log_path.name + '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def audit_security_check(
+    check: str,
+    value: str,
+    result: Dict[str, Any],
+    tool_name: Optional[str] = None,
+    audit_log: Optional[AuditLogWriter] = None
+) -> None:
+    """
+    Record one hook check in the security audit log
+
+    Values the check marks sensitive, or that hold a secret, are logged as
+    HOOK_REDACTED_VALUE. Entries are always inline: checked values never go
+    to the blob store.
+
+    Args:
+        check: Name in HOOK_CHECKS
+        value: Value that was checked
+        result: The check's result
+        tool_name: Tool named by the hook event (default: from HOOK_CHECK_FIELDS)
+        audit_log: Long-lived writer to queue the entry on (default: append_audit_log_entry())
+    """
+    field, default_tool = HOOK_CHECK_FIELDS[check]
+    if not result['allowed']:
+        action = 'blocked'
+    elif result.get('sensitive'):
+        action = 'sensitive'
+    else:
+        action = 'allowed'
+
+    details = {'check': check}
+    for key in ('reason', 'rule'):
+        if result.get(key):
+            details[key] = result[key]
+
+    if result.get('sensitive') or detect_secrets(value):
+        value = HOOK_REDACTED_VALUE
+    entry = create_security_log_entry(tool_name if isinstance(tool_name, str) else default_tool,
+                                      {field: value}, action, details)
+
+    try:
+        if audit_log is not None:
+            audit_log.write(entry)
+        else:
+            append_audit_log_entry(entry)
+    except (OSError, ValueError):
+        pass  # An unwritable (or closed) audit log must not change the verdict
+
+
+def default_security_socket_path() -> Path:
+    """Get the default Unix socket of the security check daemon"""
+    return Path.home() / '.claude' / 'security.sock'
+
+
+def handle_security_request(line: bytes, audit_log: Optional[AuditLogWriter] = None) -> Dict[str, Any]:
+    """
+    Answer one daemon request
+
+    Args:
+        line: JSON object {"check": name in HOOK_CHECKS, "value": string,
+            optionally "tool": tool name from the hook event}
+        audit_log: Record the check on this writer (see audit_security_check())
+
+    Returns:
+        The check result, or {'error': message} for a malformed request
+    """
+    try:
+        request = json.loads(line)
+        check = HOOK_CHECKS[request['check']]
+        value = request['value']
+    except (ValueError, KeyError, TypeError):
+        return {'error': 'malformed request'}
+
+    if not isinstance(value, str):
+        return {'error': 'value must be a string'}
+
+    result = check(value)
+    if audit_log is not None:
+        audit_security_check(request['check'], value, result, request.get('tool'), audit_log)
+    return result
+
+
+def serve_security_checks(socket_path: Optional[Union[str, Path]] = None) -> None:
+    """
+    Run the security check daemon until interrupted
+
+    Rule sets are compiled once at startup. Each connection sends
+    newline-delimited JSON requests and gets one JSON line back per request.
+    Every check is queued on the shared AuditLogWriter. The socket is created
+    mode 0600 so only the owning user can query it.
+
+    Args:
+        socket_path: Unix socket to listen on (default: default_security_socket_path())
+
+    Raises:
+        RuntimeError: If another daemon is already listening on the socket
+    """
+    import socket
+    import socketserver
+
+    socket_path = Path(socket_path or default_security_socket_path())
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if socket_path.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(socket_path))
+            raise RuntimeError(f"Security daemon already running on {socket_path}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            socket_path.unlink()  # Stale socket from a daemon that exited
+        finally:
+            probe.close()
+
+    get_command_classifier()
+    check_file_access('')
+    audit_log = get_audit_log_writer()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                self.wfile.write(json.dumps(handle_security_request(line, audit_log)).encode() + b'\n')
+                self.wfile.flush()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    old_umask = os.umask(0o177)
+    try:
+        server = Server(str(socket_path), Handler)
+    finally:
+        os.umask(old_umask)
+
+    if threading.current_thread() is threading.main_thread():
+        import signal
+
+        def stop(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, stop)  # Clean up the socket on kill as on Ctrl-C
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            socket_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line entry point for the security utilities
+    """
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Claude Code security utilities')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan_tree_parser = subparsers.add_parser('scan-tree', help='Scan a working tree for secrets (JSONL output)')
+    scan_tree_parser.add_argument('root', nargs='?', default='.', help='Directory to scan')
+    scan_tree_parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    scan_tree_parser.add_argument('--max-file-size', type=int, default=None, help='Skip files larger than this (bytes)')
+    scan_tree_parser.add_argument('--no-cache', action='store_true', help='Ignore and do not update the scan cache')
+
+    subparsers.add_parser('scan-staged', help='Scan lines added by staged git changes (JSONL output)')
+
+    classify_parser = subparsers.add_parser(
+        'classify-commands', help='Classify Bash hook events (JSONL in) and write verdicts (JSONL out)'
+    )
+    classify_parser.add_argument('input', nargs='?', default='-', help='JSONL file of hook events (default: stdin)')
+    classify_parser.add_argument('--stats', action='store_true', help='Print throughput to stderr')
+
+    serve_parser = subparsers.add_parser('serve', help='Run the security check daemon on a Unix socket')
+    serve_parser.add_argument('--socket', default=None, help='Socket path (default: ~/.claude/security.sock)')
+
+    logs_parser = subparsers.add_parser('logs', help='Query the indexed security and activity logs (JSONL output)')
+    logs_parser.add_argument('--log', action='append', default=None, help='Log file (repeatable; default: ~/.claude/logs)')
+    logs_parser.add_argument('--index', default=None, help='Index file (default: ~/.claude/log_index.sqlite)')
+    logs_parser.add_argument('--since', default=None, help='Earliest time, inclusive (ISO 8601)')
+    logs_parser.add_argument('--until', default=None, help='Latest time, exclusive (ISO 8601)')
+    logs_parser.add_argument('--tool', default=None, help='Only this tool_name')
+    logs_parser.add_argument('--action', default=None, help='Only this action (e.g. blocked)')
+    logs_parser.add_argument('--input-hash', default=None, help='Only this input hash')
+    logs_parser.add_argument('--count', action='store_true', help='Print the number of matching entries')
+    logs_parser.add_argument('--bucket', default=None, help='Count per minute, hour, day or N seconds')
+    logs_parser.add_argument('--by', choices=LOG_INDEX_GROUPS, default=None, help='Count per action, tool_name or log')
+    logs_parser.add_argument('--limit', type=int, default=None, help='Print at most this many entries')
+    logs_parser.add_argument('--no-update', action='store_true', help='Query the index without reading new log lines')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'scan-tree':
+        found = False
+        cache_path = None if args.no_cache else default_scan_cache_path(args.root)
+        for finding in scan_tree(args.root, workers=args.workers, max_file_size=args.max_file_size, cache_path=cache_path):
+            found = True
+            sys.stdout.write(json.dumps(finding) + '\n')
+        sys.stdout.flush()
+        return 1 if found else 0
+
+    if args.command == 'scan-staged':
+        try:
+            findings = list(scan_staged())
+        except RuntimeError as e:
+            print(str(e), file=sys.stderr)
+            return 2
+        for finding in findings:
+            sys.stdout.write(json.dumps(finding) + '\n')
+        sys.stdout.flush()
+        return 1 if findings else 0
+
+    if args.command == 'classify-commands':
+        import time
+
+        source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', errors='replace')
+        classify = get_command_classifier().classify
+        encoded = {}  # Few distinct verdicts, so each is serialized once
+        blocked = 0
+        count = 0
+        start = time.perf_counter()
+
+        with source:
+            for line in source:
+                if not line.strip():
+                    continue
+                count += 1
+                try:
+                    event = json.loads(line)
+                    tool_input = event.get('tool_input', event)
+                    command = tool_input.get('command') or ''
+                except (ValueError, AttributeError):
+                    sys.stdout.write('{"error": "invalid event"}\n')
+                    continue
+
+                verdict = classify(command if isinstance(command, str) else json.dumps(command))
+                key = (verdict['reason'], verdict['rule'], verdict['sensitive'])
+                out = encoded.get(key)
+                if out is None:
+                    out = encoded[key] = json.dumps(verdict) + '\n'
+                sys.stdout.write(out)
+                blocked += not verdict['allowed']
+
+        sys.stdout.flush()
+        if args.stats:
+            elapsed = time.perf_counter() - start
+            rate = count / elapsed if elapsed else 0.0
+            print(f"{count} events, {blocked} blocked, {elapsed:.2f}s ({rate:,.0f} events/s)", file=sys.stderr)
+        return 0
+
+    if args.command == 'serve':
+        try:
+            serve_security_checks(args.socket)
+        except RuntimeError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        return 0
+
+    if args.command == 'logs':
+        filters = {
+            'start': args.since,
+            'end': args.until,
+            'tool_name': args.tool,
+            'action': args.action,
+            'input_hash': args.input_hash,
+            'logs': args.log
+        }
+        bucket = int(args.bucket) if args.bucket and args.bucket.isdigit() else args.bucket
+
+        try:
+            with LogIndex(args.index) as index:
+                if not args.no_update:
+                    index.update(args.log)
+                if bucket is not None or args.by is not None:
+                    rows = index.aggregate(bucket, args.by, **filters)
+                elif args.count:
+                    rows = [{'count': index.count(**filters)}]
+                else:
+                    rows = index.entries(limit=args.limit, **filters)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return 2
+
+        for row in rows:
+            sys.stdout.write(json.dumps(row) + '\n')
+        sys.stdout.flush()
+        return 0
+
+    return 0
 
-    # Rotate all .json log files
-    for log_file in logs_dir.glob('*.json'):
-        rotate_log_file(str(log_file), max_entries=1000)
 
+if __name__ == '__main__':
+    exit(main())